@@ -1,11 +1,14 @@
-import requests
 import json
+import time
+import threading
+from transport import default_session
 
 server = 'https://authserver.mojang.com'
 
 class MojangAuthentication(object):
     """Authenticate against Mojang servers"""
-    def __init__(self, clientToken, username, password=None, accessToken = None):
+    def __init__(self, clientToken, username, password=None, accessToken = None, session = None, store = None,
+            freshness = 300):
         super(MojangAuthentication, self).__init__()
         self.username = username
         self.password = password
@@ -15,8 +18,43 @@ class MojangAuthentication(object):
         self.access_token = accessToken
 
         self.client_token = clientToken
+        self.session = session or default_session()
+
+        # Tokens validated less than `freshness` seconds ago are trusted
+        # without asking the server again
+        self.store = store
+        self.freshness = freshness
+        self.validated = 0
+        self.refresher = None
+        self.refresher_stop = threading.Event()
+
+        if store and not accessToken:
+            entry = store.get(username, clientToken)
+            if entry:
+                self.access_token = entry['accessToken']
+                self.uuid = entry['uuid']
+                self.player_name = entry['playerName']
+                self.validated = entry['validated']
+
+    def is_fresh(self):
+        return bool(self.access_token) and time.time() - self.validated < self.freshness
+
+    def remember(self):
+        self.validated = time.time()
+
+        if self.store:
+            self.store.put(self.username, self.client_token, {
+                'accessToken': self.access_token,
+                'uuid': self.uuid,
+                'playerName': self.player_name,
+                'validated': self.validated
+            })
 
     def authenticate(self, password = None):
+        # A recently validated cached token is as good as a new one
+        if self.store and self.is_fresh():
+            return True
+
         if not self.password and not password:
             if self.access_token:
                 return self.validate()
@@ -37,7 +75,7 @@ class MojangAuthentication(object):
             "requestUser": True
         }
 
-        r = requests.post(server + '/authenticate', data=json.dumps(payload))
+        r = self.session.post(server + '/authenticate', data=json.dumps(payload))
 
         if r.status_code == 200:
             json_data = r.json()
@@ -48,6 +86,7 @@ class MojangAuthentication(object):
             self.access_token = json_data['accessToken']
             self.player_name = json_data['selectedProfile']['name']
             self.uuid = json_data['selectedProfile']['id']
+            self.remember()
             
             print('Successful authentication as %s!' % (self.player_name))
 
@@ -61,14 +100,18 @@ class MojangAuthentication(object):
         if not self.access_token:
             raise Exception('No access token specified!')
 
+        if self.is_fresh():
+            return True
+
         payload = {
             "clientToken": self.client_token,
             "accessToken": self.access_token
         }
 
-        r = requests.post(server + '/validate', data=json.dumps(payload))
+        r = self.session.post(server + '/validate', data=json.dumps(payload))
 
         if r.status_code == 204:
+            self.remember()
             return True
 
         return False
@@ -87,7 +130,7 @@ class MojangAuthentication(object):
             "requestUser": True
         }
 
-        r = requests.post(server + '/refresh', data=json.dumps(payload))
+        r = self.session.post(server + '/refresh', data=json.dumps(payload))
 
         if r.status_code == 200:
             json_data = r.json()
@@ -98,6 +141,7 @@ class MojangAuthentication(object):
             self.access_token = json_data['accessToken']
             self.player_name = json_data['selectedProfile']['name']
             self.uuid = json_data['selectedProfile']['id']
+            self.remember()
             
             print('Successfully refreshed %s\'s session!' % (self.player_name))
 
@@ -116,12 +160,41 @@ class MojangAuthentication(object):
             "accessToken": self.access_token
         }
 
-        r = requests.post(server + '/invalidate', data=json.dumps(payload))
+        r = self.session.post(server + '/invalidate', data=json.dumps(payload))
 
         if r.status_code == 204:
             self.access_token = None
             self.uuid = None
+            self.validated = 0
+
+            if self.store:
+                self.store.remove(self.username, self.client_token)
 
             return True
 
         return False
+
+    def start_refresher(self, interval = 3600):
+        """Refresh the session in a background thread every `interval` seconds,
+        so the token is already fresh when a launch needs it"""
+        if self.refresher:
+            return
+
+        self.refresher_stop.clear()
+
+        def run():
+            while not self.refresher_stop.wait(max(0, self.validated + interval - time.time())):
+                try:
+                    if not self.refresh():
+                        break
+                except Exception as e:
+                    print('Failed to refresh %s\'s session: %s' % (self.player_name, e))
+                    self.refresher_stop.wait(60)
+
+            self.refresher = None
+
+        self.refresher = threading.Thread(target=run, name='token-refresher', daemon=True)
+        self.refresher.start()
+
+    def stop_refresher(self):
+        self.refresher_stop.set()
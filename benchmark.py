@@ -0,0 +1,264 @@
+#!/usr/bin/python
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import threading
+import platform as pyplatform
+from optparse import OptionParser
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import client
+import clientforge
+from common import platform
+from client import asset_url
+from clientforge import mvn, mclib
+from manifest import manifest_url
+from progress import SilentProgress
+from metrics import default_metrics
+from sources import SourceResolver, mirror_location
+
+version = 'bench-1.0'
+forge_version = 'forge-1.0'
+
+class BenchAuthentication(object):
+    """Stand-in for MojangAuthentication, launchargs only needs the attributes"""
+    uuid = '00000000000000000000000000000000'
+    access_token = '0'
+    player_name = 'Bench'
+
+class Handler(SimpleHTTPRequestHandler):
+    """Static file handler with single-range and If-None-Match support"""
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        size = os.path.getsize(path)
+        etag = '"%x-%x"' % (size, os.stat(path).st_mtime_ns)
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return None
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.end_headers()
+                return None
+
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, size - 1, size))
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+        handle = open(path, 'rb')
+        handle.seek(start)
+        return handle
+
+class StandInCDN(object):
+    """Serve a directory laid out like a mirror (<host>/<path>) on localhost"""
+    def __init__(self, root):
+        super(StandInCDN, self).__init__()
+        handler = lambda *args, **kwargs: Handler(*args, directory=root, **kwargs)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:%d/' % (self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+def zip_bytes(files):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(name, content)
+
+    return data.getvalue()
+
+def put(root, url, data):
+    path = mirror_location(root, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+    return {'url': url, 'sha1': hashlib.sha1(data).hexdigest(), 'size': len(data)}
+
+def generate(root, objects, object_size, libraries):
+    """Write a synthetic version, asset index, libraries and forge jar under `root`"""
+    index = {}
+    for i in range(objects):
+        # Unique content per object so every object is a separate download
+        data = (b'%08d' % i) + os.urandom(max(0, object_size - 8))
+        sha1 = hashlib.sha1(data).hexdigest()
+        put(root, asset_url.format(prefix=sha1[0:2], hash=sha1), data)
+        index['bench/object%d' % (i)] = {'hash': sha1, 'size': len(data)}
+
+    asset_index = put(root, 'https://launchermeta.mojang.com/v1/packages/bench/bench.json',
+        json.dumps({'objects': index}).encode('utf-8'))
+    asset_index['id'] = 'bench'
+
+    libs = []
+    for i in range(libraries):
+        path = 'org/bench/lib%d/1.0/lib%d-1.0.jar' % (i, i)
+        artifact = put(root, mclib + path, zip_bytes({'bench/Lib%d.class' % (i): os.urandom(16 * 1024)}))
+        artifact['path'] = path
+        libs.append({'name': 'org.bench:lib%d:1.0' % (i), 'downloads': {'artifact': artifact}})
+
+    natives = 'natives-' + platform()
+    path = 'org/bench/native/1.0/native-1.0-%s.jar' % (natives)
+    native = put(root, mclib + path, zip_bytes(dict(('libbench%d.so' % (i), os.urandom(64 * 1024)) for i in range(8))))
+    native['path'] = path
+    libs.append({'name': 'org.bench:native:1.0', 'natives': {platform(): natives},
+        'extract': {'exclude': ['META-INF/']}, 'downloads': {'classifiers': {natives: native}}})
+
+    jar = put(root, 'https://launcher.mojang.com/v1/objects/bench/client.jar',
+        zip_bytes({'net/minecraft/client/main/Main.class': os.urandom(1024 * 1024)}))
+
+    metadata = {
+        'id': version,
+        'type': 'release',
+        'mainClass': 'net.minecraft.client.main.Main',
+        'assets': 'bench',
+        'minecraftArguments': '--username ${auth_player_name} --version ${version_name} --gameDir ${game_directory} '
+            '--assetsDir ${assets_root} --assetIndex ${assets_index_name} --uuid ${auth_uuid} '
+            '--accessToken ${auth_access_token} --userType ${user_type} --versionType ${version_type}',
+        'assetIndex': asset_index,
+        'downloads': {'client': jar},
+        'libraries': libs
+    }
+    meta = put(root, 'https://launchermeta.mojang.com/v1/packages/bench/%s.json' % (version),
+        json.dumps(metadata).encode('utf-8'))
+
+    put(root, manifest_url, json.dumps({
+        'latest': {'release': version, 'snapshot': version},
+        'versions': [{'id': version, 'type': 'release', 'url': meta['url']}]
+    }).encode('utf-8'))
+
+    # Forge universal jar: its version.json pulls in one extra library
+    forge_name = version + '-' + re.sub(r'^forge-', '', forge_version)
+    put(root, mclib + 'org/bench/forgelib/1.0/forgelib-1.0.jar', zip_bytes({'bench/ForgeLib.class': b'0'}))
+    forge_meta = {
+        'id': version + '-' + forge_version,
+        'inheritsFrom': version,
+        'mainClass': 'net.minecraft.launchwrapper.Launch',
+        'minecraftArguments': metadata['minecraftArguments'] + ' --tweakClass bench.Tweaker',
+        'libraries': [
+            {'name': 'net.minecraftforge:forge:%s' % (forge_name), 'url': mvn},
+            {'name': 'org.bench:forgelib:1.0'}
+        ]
+    }
+    put(root, mvn + 'net/minecraftforge/forge/{name}/forge-{name}-universal.jar'.format(name=forge_name),
+        zip_bytes({'version.json': json.dumps(forge_meta), 'net/minecraftforge/Forge.class': os.urandom(512 * 1024)}))
+
+def timed(results, name, fn, *args):
+    start = time.monotonic()
+    value = fn(*args)
+    results[name] = time.monotonic() - start
+    return value
+
+def run(objects = 2000, object_size = 4096, libraries = 40, workers = 8, iterations = 100):
+    """Run every benchmark against a fresh stand-in CDN, returning the results"""
+    work = tempfile.mkdtemp(prefix='pymclaunch-bench-')
+    results = {}
+
+    try:
+        content = os.path.join(work, 'cdn')
+        generate(content, objects, object_size, libraries)
+
+        with StandInCDN(content) as cdn:
+            def make_client(root, cls = client.MinecraftClient, *args):
+                return cls(root, version, *args, os.path.join(work, 'game'), authentication=BenchAuthentication(),
+                    workers=workers, progress=SilentProgress(), resolver=SourceResolver([cdn.url]))
+
+            root = os.path.join(work, 'root')
+
+            mc = make_client(root)
+            timed(results, 'cold_install', mc.install)
+            results['cold_install_stages'] = dict(mc.timings)
+
+            timed(results, 'warm_install', make_client(root).install)
+            timed(results, 'full_verify', make_client(root).verify)
+
+            mc = make_client(root)
+            timed(results, 'extract_natives_cold', mc.extract_natives)
+            mc = make_client(root)
+            timed(results, 'extract_natives_warm', mc.extract_natives)
+
+            mc = make_client(root)
+            timed(results, 'launchargs_cold', mc.launchargs)
+
+            def warm_launchargs():
+                for i in range(iterations):
+                    make_client(root).launchargs()
+
+            timed(results, 'launchargs_warm', warm_launchargs)
+            results['launchargs_warm'] /= iterations
+
+            forge = make_client(root, clientforge.MinecraftClientForge, forge_version)
+            timed(results, 'forge_install', forge.install_forge)
+    finally:
+        shutil.rmtree(work)
+
+    return {
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'platform': pyplatform.platform(),
+        'parameters': {
+            'objects': objects,
+            'object_size': object_size,
+            'libraries': libraries,
+            'workers': workers,
+            'iterations': iterations
+        },
+        'results': results,
+        'metrics': default_metrics().snapshot()
+    }
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-n', '--objects', dest='objects', type='int', default=2000,
+        help='Number of asset objects (default: 2000)')
+    parser.add_option('-s', '--object-size', dest='object_size', type='int', default=4096,
+        help='Size of every asset object in bytes (default: 4096)')
+    parser.add_option('-l', '--libraries', dest='libraries', type='int', default=40,
+        help='Number of libraries (default: 40)')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=8,
+        help='Maximum number of concurrent downloads (default: 8)')
+    parser.add_option('-i', '--iterations', dest='iterations', type='int', default=100,
+        help='Warm launchargs iterations (default: 100)')
+    parser.add_option('-o', '--output', dest='output',
+        help='Write the results as JSON to this file instead of stdout')
+
+    (options, args) = parser.parse_args()
+
+    report = run(options.objects, options.object_size, options.libraries, options.workers, options.iterations)
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
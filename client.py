@@ -1,20 +1,85 @@
 #!/usr/bin/python
-import requests
 import os
 import re
+import sys
 import json
 import zipfile
-import time
 import shutil
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import tempfile
 import subprocess
 import lzma
-from common import ensure_dir, save_to_file, platform, save_to_file_sha1
+from common import ensure_dir, fetch, platform, download_all, replace_file
+from transport import default_session
+from verify import VerificationIndex, sha1_file, list_objects
+from rules import resolve_libraries, rules_allow
+from manifest import VersionManifest, load_json, revalidate, is_fresh
+from logcapture import LogCapture, PrintSink
+from metrics import default_metrics
+from java import java_version, default_jvm, cds_archive, cds_options
 
 lib_url = 'https://libraries.minecraft.net/{package}/{name}/{version}/{name}-{version}.jar'
+meta_url = 'https://s3.amazonaws.com/Minecraft.Download/versions/{version}/{version}.json'
+asset_url = 'http://resources.download.minecraft.net/{prefix}/{hash}'
+
+# Asset keys needed to boot, fetched first when fast_start is True
+critical_assets = ['icons/', 'pack.mcmeta', 'minecraft/font/', 'minecraft/textures/', 'minecraft/shaders/',
+    'minecraft/lang/en_us', 'minecraft/lang/en_US']
+
+def natives_key(natives):
+    # The natives are extracted once into a directory named after the jars
+    # and extract rules that went into it, and reused by later launches.
+    key = hashlib.sha1()
+    for lib, native in natives:
+        key.update(json.dumps([native['path'], native.get('sha1'), lib.get('extract')], sort_keys=True).encode('utf-8'))
+
+    return key.hexdigest()
+
+class LaunchSummary(object):
+    """Hand a summary of the metrics of one launch to the exporters of `default_metrics()`
+
+    Preparing, starting and waiting for the game go inside the `with`
+    block, which calls `started()` once the process runs and sets
+    `returncode` when it exits. The record goes out when the block is left,
+    also when the launch failed (with the reason in `error`) or never got
+    to start the game."""
+    def __init__(self, client):
+        super(LaunchSummary, self).__init__()
+        self.client = client
+        self.metrics = default_metrics()
+        self.since = None
+        self.start = None
+        self.startup = None
+        self.returncode = None
+        self.error = None
+
+    def __enter__(self):
+        self.since = self.metrics.snapshot()
+        self.start = time.monotonic()
+        return self
+
+    def started(self):
+        self.startup = time.monotonic() - self.start
+
+    def __exit__(self, exc_type, exc, tb):
+        fields = {}
+        if exc is not None:
+            self.error = str(exc)
+        if self.error is not None:
+            fields['error'] = self.error
+
+        self.metrics.summary('launch', self.since, version=self.client.version_name, returncode=self.returncode,
+            startup=self.startup, duration=time.monotonic() - self.start, stages=dict(self.client.timings), **fields)
 
 class MinecraftClient(object):
     """Launch a vanilla Minecraft client"""
-    def __init__(self, clientRoot, mcVersion, gamedir, authentication = None, jvm = None, **kwargs):
+    def __init__(self, clientRoot, mcVersion, gamedir, authentication = None, jvm = None, workers = 8,
+            session = None, progress = None, store = None, resolver = None, cds = False, fast_start = None,
+            **kwargs):
         super(MinecraftClient, self).__init__()
         self.mcver = mcVersion
         self.client_root = clientRoot
@@ -23,33 +88,120 @@ class MinecraftClient(object):
         self.game_dir = gamedir
         self.metadata = None
         self.natives = None
+        self.plan = None
+        self.resolved = None
         self.library_paths = []
+        self.workers = workers
+        self.session = session or default_session()
+        self.progress = progress
+        self.store = store
+        self.resolver = resolver
+        self.meta_ttl = 3600
+        self.verifier = None
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.log = None
+        self.java = 'java'
+        self.cds = cds
+        self.cds_pending = None
+        self.use_argfile = True
+        self.fast_start = fast_start
+        self.background = None
+        self.background_workers = 2
+        self.background_error = None
+        self.assets_complete = threading.Event()
+        self.on_assets_complete = None
         self.kwargv = kwargs
 
+        # GC flags depend on what the installed Java supports
         if not jvm:
-            self.jvm = '-Xmx1G -XX:+UseConcMarkSweepGC -XX:+CMSIncrementalMode -XX:-UseAdaptiveSizePolicy -Xmn128M'
+            self.jvm = default_jvm(self.java_version())
         else:
             self.jvm = jvm
 
         self.authentication = authentication
 
+    def java_version(self):
+        ensure_dir(self.client_root)
+        return java_version(self.java, os.path.join(self.client_root, 'java.json'))
+
+    def meta_path(self):
+        return os.path.join(self.version_directory, '%s.json' % self.version_name)
+
+    def version_url(self):
+        manifest = VersionManifest(os.path.join(self.client_root, 'versions'), self.session, self.meta_ttl,
+            self.progress, self.resolver)
+
+        try:
+            url = manifest.url(self.mcver)
+        except IOError:
+            url = None
+
+        return url or meta_url.format(version=self.mcver)
+
     def get_meta(self):
         ensure_dir(self.version_directory)
-        metafile = os.path.join(self.version_directory, '%s.json' % self.version_name)
-
-        if not os.path.exists(metafile):
+        metafile = self.meta_path()
+
+        # Forge keeps its own, modified copy of the metadata which must not be
+        # replaced by the vanilla one
+        if self.version_name == self.mcver:
+            if not is_fresh(metafile, self.meta_ttl):
+                print('Checking metadata from Minecraft Downloads CDN...')
+                revalidate(self.version_url(), metafile, self.meta_ttl, self.session, self.progress, self.resolver)
+        elif not os.path.exists(metafile):
             print('Grabbing metadata from Minecraft Downloads CDN...')
 
-            # Get version metadata
-            r = requests.get('https://s3.amazonaws.com/Minecraft.Download/versions/%s/%s.json' % (self.mcver, self.mcver), stream=True)
+            # Get version metadata and save it
+            fetch(self.version_url(), metafile, session=self.session, progress=self.progress,
+                resolver=self.resolver)
+
+        # Shared with other clients in this process, never modified in place
+        self.metadata = load_json(metafile)
+
+        self.resolved = None
 
-            # Save the file
-            save_to_file(metafile, r)
+    def timed(self, stage, fn, *args):
+        start = time.monotonic()
 
-        with open(metafile) as json_data:
-            self.metadata = json.load(json_data)
+        try:
+            return fn(*args)
+        finally:
+            self.timings[stage] = time.monotonic() - start
+            default_metrics().add_time('install.' + stage, self.timings[stage])
 
     def install(self):
+        """Install the version jar, libraries and assets.
+
+        Once the metadata is in, the three run concurrently, and asset
+        objects start downloading as soon as the asset index arrives. The
+        seconds spent per stage end up in `timings`."""
+        self.timings = {}
+        self.log = None
+        start = time.monotonic()
+
+        if not self.metadata:
+            self.timed('metadata', self.get_meta)
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            jobs = [
+                pool.submit(self.timed, 'version_jar', self.get_version_jar),
+                pool.submit(self.timed, 'libraries', self.get_libraries),
+                pool.submit(self.timed, 'assets', self.get_assets)
+            ]
+
+            for job in jobs:
+                job.result()
+
+        self.timings['install'] = time.monotonic() - start
+        default_metrics().add_time('install', self.timings['install'])
+
+    async def install_async(self):
+        """Run `install` without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.install)
+
+    def get_version_jar(self):
         if not self.metadata:
             self.get_meta()
 
@@ -57,22 +209,59 @@ class MinecraftClient(object):
 
         print(self.metadata['downloads'])
 
-        if not os.path.exists(rfile):
+        client_dl = self.metadata['downloads']['client']
+        if not self.is_installed(rfile, client_dl.get('sha1')):
             print('Downloading version jar...')
-            rv = requests.get(self.metadata['downloads']['client']['url'], stream=True)
-
-            save_to_file(rfile, rv)
+            self.download(client_dl['url'], rfile, client_dl.get('sha1'))
         else:
             print('Skipping version jar download..')
 
-        self.get_libraries()
-        self.get_assets()
-
     def load_profile(self):
         pass
 
+    def get_verifier(self):
+        with self.lock:
+            if not self.verifier:
+                ensure_dir(self.client_root)
+                self.verifier = VerificationIndex(os.path.join(self.client_root, 'verify.db'))
+
+        return self.verifier
+
+    def is_installed(self, path, sha1 = None):
+        # Without a hash all we can do is check that the file is there
+        if not sha1:
+            return os.path.exists(path)
+
+        return self.get_verifier().check(path, sha1)
+
+    def download(self, url, path, sha1 = None):
+        # Files with a known hash go through the shared store, if there is one
+        if self.store and sha1:
+            self.store.fetch(url, sha1, path, self.session, self.progress, self.resolver)
+        else:
+            fetch(url, path, sha1, self.session, self.progress, resolver=self.resolver)
+
+        if sha1:
+            self.get_verifier().record(path, sha1)
+
+        return path
+
+    def verify(self, workers = None):
+        """Re-hash every installed file on all cores, removing the ones that are corrupt.
+
+        Returns the removed paths; run `install` afterwards to download them again."""
+        failed = self.get_verifier().verify_all(workers)
+
+        for path in failed:
+            if os.path.exists(path):
+                os.remove(path)
+
+        print('Verified installed files, %d corrupt.' % (len(failed)))
+
+        return failed
+
     def get_assets(self):
-        if self.metadata:
+        if not self.metadata:
             self.get_meta()
 
         print('Verifying assets..')
@@ -84,39 +273,195 @@ class MinecraftClient(object):
         asset_index = self.metadata['assetIndex']
         assets_file = os.path.join(assets_versions, '%s.json' % (asset_index['id']))
 
-        if not os.path.exists(assets_file):
-            r = requests.get(asset_index['url'], stream=True)
-
+        if not self.is_installed(assets_file, asset_index['sha1']):
             try:
-                save_to_file_sha1(assets_file, r, asset_index['sha1'])
+                self.timed('asset_index', self.download, asset_index['url'], assets_file, asset_index['sha1'])
             except Exception:
                 print('Failed to download assets!')
                 raise
 
-        with open(assets_file) as json_data:
-            assets = json.load(json_data)
+        assets = load_json(assets_file)
 
-        for key, data in assets['objects'].items():
+        jobs = []
+        critical = []
+        prefixes = tuple(critical_assets if self.fast_start is True else self.fast_start or [])
+        directories = set()
+
+        for key in self.missing_assets(assets['objects']):
+            data = assets['objects'][key]
             first = data['hash'][0:2]
-            asset_url = 'http://resources.download.minecraft.net/%s/%s' % (first, data['hash'])
+            url = asset_url.format(prefix=first, hash=data['hash'])
             asset_dir = os.path.join(assets_dir, 'objects', first)
 
-            ensure_dir(asset_dir)
+            if asset_dir not in directories:
+                ensure_dir(asset_dir)
+                directories.add(asset_dir)
 
             asset_file = os.path.join(asset_dir, data['hash'])
-            
-            if os.path.exists(asset_file):
-                continue
 
-            r = requests.get(asset_url, stream=True)
+            if prefixes and key.startswith(prefixes):
+                critical.append((url, asset_file, data['hash']))
+            else:
+                jobs.append((url, asset_file, data['hash']))
+
+        if not prefixes:
+            self.install_assets(jobs, self.workers, 'assets')
+
+            # This also completes what an earlier fast start left behind
+            self.clear_pending()
+
+            print('All assets verified.')
+            return
+
+        # Fast start: only what the game needs to boot is fetched now, the
+        # rest is completed in the background while the game runs
+        self.install_assets(critical, self.workers, 'assets')
+        print('Critical assets verified, %d more in the background.' % (len(jobs)))
+
+        self.complete_assets(jobs)
+
+    def missing_assets(self, objects):
+        """Keys of the asset `objects` that are missing or damaged
+
+        Each hash prefix directory is listed once and the result compared in
+        bulk with the verification index. Only files whose size or mtime
+        changed since they were last verified are hashed again."""
+        objects_dir = os.path.join(self.client_root, 'assets', 'objects')
+        present = list_objects(objects_dir, set(data['hash'][0:2] for data in objects.values()))
+
+        verifier = self.get_verifier()
+        recorded = verifier.entries(objects_dir)
+        base = verifier.key(objects_dir)
+
+        missing = []
+        changed = []
+
+        for key, data in objects.items():
+            sha1 = data['hash']
+            st = present.get(sha1)
+
+            # The size from the asset index is a free integrity check
+            if st is None or ('size' in data and not st[0] == data['size']):
+                missing.append(key)
+            elif not recorded.get(os.path.join(base, sha1[0:2], sha1)) == (st[0], st[1], sha1):
+                changed.append(key)
+
+        default_metrics().count('verify.hits', len(objects) - len(missing) - len(changed))
+        default_metrics().count('verify.misses', len(missing))
+
+        if changed:
+            def intact(key):
+                sha1 = objects[key]['hash']
+                return verifier.check(os.path.join(objects_dir, sha1[0:2], sha1), sha1)
+
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                missing += [key for key, ok in zip(changed, pool.map(intact, changed)) if not ok]
+
+        return missing
+
+    def install_assets(self, jobs, workers, label):
+        # With a shared store, objects are downloaded into the store once and
+        # then linked into this root
+        links = []
+        if self.store:
+            links = [(sha1, path) for url, path, sha1 in jobs]
+
+            # Objects already in the store are hashed before they are linked,
+            # damaged ones are evicted and downloaded again. Many asset keys
+            # share an object, which is checked and downloaded only once.
+            urls = dict((sha1, url) for url, path, sha1 in jobs)
+            hashes = sorted(urls)
+
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                intact = list(pool.map(self.store.check, hashes))
+
+            jobs = [(urls[sha1], self.store.path(sha1), sha1) for sha1, ok in zip(hashes, intact) if not ok]
+
+            for url, path, sha1 in jobs:
+                ensure_dir(os.path.dirname(path))
+
+        try:
+            download_all(jobs, workers, label, self.session, self.progress, resolver=self.resolver)
+        except Exception:
+            print('Failed to download assets!')
+            raise
+
+        for sha1, path in links:
+            self.store.link(sha1, path)
+
+        if self.store:
+            self.get_verifier().record_many([(path, sha1) for sha1, path in links])
+        else:
+            self.get_verifier().record_many([(path, sha1) for url, path, sha1 in jobs])
+
+    def pending_path(self):
+        return os.path.join(self.version_directory, 'assets.pending')
+
+    def clear_pending(self):
+        # Another client of this version may have finished the assets first
+        try:
+            os.remove(self.pending_path())
+        except FileNotFoundError:
+            pass
+
+    def complete_assets(self, jobs):
+        """Download the remaining asset objects on a low priority background thread
+
+        `assets_complete` is set once they are all in (check
+        `background_error`), and `on_assets_complete` is called with the
+        error, if any. Until then a marker file makes the next `prepare`
+        install again, even with a valid launch plan."""
+        self.assets_complete.clear()
+        self.background_error = None
+
+        if not jobs:
+            self.clear_pending()
+
+            self.finish_assets(None)
+            return
+
+        open(self.pending_path(), 'w').close()
+
+        def run():
+            # Threads started from here (the download pool) inherit the priority
+            if sys.platform.startswith('linux'):
+                try:
+                    os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+                except OSError:
+                    pass
 
             try:
-                save_to_file(asset_file, r)
+                with default_metrics().timer('assets.background'):
+                    self.install_assets(jobs, self.background_workers, 'background assets')
+
+                self.clear_pending()
+                error = None
             except Exception as e:
-                print('Failed to download asset %s!' % (key))
-                raise e
+                error = e
 
-        print('All assets verified.')
+            self.finish_assets(error)
+
+        self.background = threading.Thread(target=run, name='assets-%s' % (self.version_name), daemon=True)
+        self.background.start()
+
+    def finish_assets(self, error):
+        self.background_error = error
+
+        try:
+            if self.on_assets_complete:
+                self.on_assets_complete(error)
+        finally:
+            self.assets_complete.set()
+
+    def wait_assets(self, timeout = None):
+        """Block until background asset downloads are done, raising their error if they failed"""
+        if self.background and not self.assets_complete.wait(timeout):
+            return False
+
+        if self.background_error:
+            raise self.background_error
+
+        return True
 
     def artifact(self, artifact, backup = None):
         lib_directory = os.path.join(self.client_root, 'libraries')
@@ -130,7 +475,7 @@ class MinecraftClient(object):
         ensure_dir(directory)
 
         # Make sure it doesn't already exist
-        if os.path.exists(artifact_path):
+        if self.is_installed(artifact_path, artifact.get('sha1')):
             print('Artifact %s exists, skipping..' % artifact['path'])
             return True
 
@@ -141,12 +486,10 @@ class MinecraftClient(object):
             url_dl += '.pack.xz'
             artifact_path += '.pack.xz'
 
-        r = requests.get(url_dl, stream=True)
-
         if 'sha1' in artifact and not 'lzma' in artifact:
-            f = save_to_file_sha1(artifact_path, r, artifact['sha1'])
+            f = self.download(url_dl, artifact_path, artifact['sha1'])
         else:
-            f = save_to_file(artifact_path, r)
+            f = self.download(url_dl, artifact_path)
 
         if 'lzma' in artifact and artifact['lzma'] == True:
             # Only unpack if we're a Forge client
@@ -155,201 +498,414 @@ class MinecraftClient(object):
 
         return artifact_path
 
-    def get_libraries(self):
+    def resolved_libraries(self):
         if not self.metadata:
             self.get_meta()
 
-        for lib in self.metadata['libraries']:
-            lname = lib['name'].split(':')
-            lurl = lib_url.format(package=lname[0], name=lname[1], version=lname[2])
-
-            skiplib = False
-
-            # Check Rules
-            if 'rules' in lib:
-                for rule in lib['rules']:
-                    if 'action' in rule:
-                        if rule['action'] == 'allow' and 'os' in rule:
-                            if not rule['os']['name'] == platform():
-                                skiplib = True
-                        if rule['action'] == 'noallow' and 'os' in rule:
-                            if rule['os']['name'] == platform():
-                                skiplib = True
-            if skiplib:
-                continue
+        # Library rules are only evaluated once per metadata
+        if not self.resolved:
+            self.resolved = resolve_libraries(self.metadata['libraries'])
 
-            # Skip non-download-included for now
-            if not 'downloads' in lib:
-                continue
+        return self.resolved
 
-            dl = lib['downloads']
+    def get_libraries(self):
+        resolved = self.resolved_libraries()
 
-            if 'natives' in lib:
-                if platform() in lib['natives']:
-                    platform_native = lib['natives'][platform()]
+        self.library_paths = [os.path.join(self.client_root, 'libraries', artifact['path'])
+            for lib, artifact in resolved.classpath]
 
-                    if platform_native in dl['classifiers']:
-                        try:
-                            self.artifact(dl['classifiers'][platform_native], lname)
-                        except Exception as e:
-                            print('Failed to download native library %s due to errors.' % (lib['name']))
-                            raise e
-            elif 'classifiers' in dl and 'natives-' + platform() in dl['classifiers']:
-                self.library_paths.append(os.path.join(os.path.join(self.client_root, 'libraries', 
-                    dl['classifiers']['natives-' + platform()]['path'])))
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            jobs = [(lib, pool.submit(self.artifact, artifact, lib['name'].split(':')))
+                for lib, artifact in resolved.downloads]
 
-            if not 'artifact' in dl:
-                continue
+            for lib, job in jobs:
+                try:
+                    job.result()
+                except Exception as e:
+                    print('Failed to download library %s due to errors.' % (lib['name']))
+                    raise e
 
-            self.library_paths.append(os.path.join(os.path.join(self.client_root, 'libraries', dl['artifact']['path'])))
+    def extract_natives(self):
+        natives = self.resolved_libraries().natives
+
+        natives_root = os.path.join(self.version_directory, 'natives')
+        natives_dir = os.path.join(natives_root, natives_key(natives))
+
+        if os.path.isdir(natives_dir):
+            # Touched on reuse, so storegc sees it is still in use
+            os.utime(natives_dir)
+            default_metrics().count('natives.hits')
+            self.natives = natives_dir
+            return
+
+        default_metrics().count('natives.misses')
+        ensure_dir(natives_root)
+
+        # Extract into a private directory first and rename it into place, so
+        # several instances starting at once never see a half-extracted cache
+        natives_tmpdir = tempfile.mkdtemp(dir=natives_root, prefix='.tmp-')
+
+        try:
+            with default_metrics().timer('extract_natives'):
+                for lib, native in natives:
+                    exclude = lib.get('extract', {}).get('exclude', ['META-INF/'])
+
+                    try:
+                        with zipfile.ZipFile(os.path.join(self.client_root, 'libraries', native['path']), 'r') as zip_ref:
+                            members = [m for m in zip_ref.namelist() if not any(m.startswith(e) for e in exclude)]
+                            zip_ref.extractall(natives_tmpdir, members)
+                    except Exception as e:
+                        print('Failed to extract native library %s due to errors.' % (lib['name']))
+                        raise e
 
             try:
-                self.artifact(dl['artifact'], lname)
-            except Exception as e:
-                print('Failed to download library %s due to errors.' % (lib['name']))
-                raise e
+                os.rename(natives_tmpdir, natives_dir)
+            except OSError:
+                # Somebody else finished extracting the same natives first
+                if not os.path.isdir(natives_dir):
+                    raise
+        finally:
+            if os.path.exists(natives_tmpdir):
+                shutil.rmtree(natives_tmpdir)
+
+        self.natives = natives_dir
+
+    def cds_args(self, plan):
+        """JVM options for the class data sharing archive of this classpath, if `cds` is on"""
+        self.cds_pending = None
+
+        if not self.cds:
+            return []
+
+        version = self.java_version()
+        directory = os.path.join(self.version_directory, 'cds')
+        archive = cds_archive(directory, plan['classpath'], self.java, version)
+        ensure_dir(directory)
 
-    def extract_natives(self):
-        if not self.metadata:
-            self.get_meta()
-        
-        natives_tmpdir = os.path.join(self.version_directory, 'natives-' + str(int(time.time())))
-        ensure_dir(natives_tmpdir)
-
-        for lib in self.metadata['libraries']:
-            skiplib = False
-
-            # Check Rules
-            if 'rules' in lib:
-                for rule in lib['rules']:
-                    if 'action' in rule:
-                        if rule['action'] == 'allow' and 'os' in rule:
-                            if not rule['os']['name'] == platform():
-                                skiplib = True
-                        if rule['action'] == 'noallow' and 'os' in rule:
-                            if rule['os']['name'] == platform():
-                                skiplib = True
-            if skiplib:
+        # Java 13 to 18 write a new archive when the game exits. Every
+        # instance dumps to its own file, which cleanup moves into place.
+        dump = '%s.%d-%x.tmp' % (archive, os.getpid(), id(self))
+        args = cds_options(version, archive, dump)
+
+        if any(a.startswith('-XX:ArchiveClassesAtExit=') for a in args):
+            self.cds_pending = (dump, archive)
+
+        return args
+
+    def cleanup(self):
+        # Extracted natives are cached for the next launch, only a freshly
+        # dumped class data archive has to be put in place
+        if self.cds_pending:
+            dump, archive = self.cds_pending
+            self.cds_pending = None
+
+            if os.path.exists(dump):
+                os.replace(dump, archive)
+
+    def features(self):
+        return {
+            'has_custom_resolution': 'width' in self.kwargv and 'height' in self.kwargv,
+            'is_demo_user': 'demo' in self.kwargv
+        }
+
+    def arguments(self, args):
+        result = []
+        for arg in args:
+            if not isinstance(arg, dict):
+                result.append(arg)
                 continue
 
-            # Skip non-download-included for now
-            if not 'downloads' in lib:
+            if not rules_allow(arg.get('rules'), self.features()):
                 continue
 
-            dl = lib['downloads']
+            if isinstance(arg['value'], list):
+                result += arg['value']
+            else:
+                result.append(arg['value'])
 
-            if 'natives' in lib and 'extract' in lib:
-                if platform() in lib['natives']:
-                    platform_native = lib['natives'][platform()]
+        return result
 
-                    if platform_native in dl['classifiers']:
-                        try:
-                            zip_ref = zipfile.ZipFile(os.path.join(self.client_root, 'libraries', 
-                                dl['classifiers'][platform_native]['path']), 'r')
-                            zip_ref.extractall(natives_tmpdir)
-                            zip_ref.close()
-                        except Exception as e:
-                            print('Failed to extract native library %s due to errors.' % (lib['name']))
-                            raise e
+    def plan_path(self):
+        # Instances of one version may differ in JVM options and features, so
+        # each combination gets its own plan
+        key = json.dumps([platform(), self.jvm, self.features()], sort_keys=True)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
 
-        metainf = os.path.join(natives_tmpdir, 'META-INF')
+        return os.path.join(self.version_directory, 'plans', '%s.json' % key)
 
-        if os.path.exists(metainf):
-            shutil.rmtree(metainf)
+    def build_plan(self):
+        """Resolve everything needed to start the game that does not change between launches"""
+        if not self.metadata:
+            self.get_meta()
+        if not self.library_paths:
+            self.get_libraries()
+        if not self.natives:
+            self.extract_natives()
 
-        self.natives = natives_tmpdir
+        features = self.features()
 
-    def cleanup(self):
-        shutil.rmtree(self.natives)
+        # Older arguments
+        if 'minecraftArguments' in self.metadata:
+            jvm = self.jvm.split() + ['-Djava.library.path=${natives_directory}', '-cp', '${classpath}']
+            game = self.metadata['minecraftArguments'].split()
 
-    def launchargs(self):
-        self.library_paths.append(os.path.join(self.version_directory, '%s.jar' % (self.version_name)))
-        gamefmt = {
+            if features['has_custom_resolution']:
+                game += ['--width', '${resolution_width}', '--height', '${resolution_height}']
+
+            if features['is_demo_user']:
+                game.append('--demo')
+        # New arguments system
+        else:
+            jvm = self.jvm.split() + self.arguments(self.metadata['arguments']['jvm'])
+            game = self.arguments(self.metadata['arguments']['game'])
+
+        metafile = self.meta_path()
+        st = os.stat(metafile)
+
+        return {
+            'meta_stat': [st.st_size, st.st_mtime_ns],
+            'meta_sha1': sha1_file(metafile),
+            'classpath': self.library_paths + [os.path.join(self.version_directory, '%s.jar' % (self.version_name))],
+            'main_class': self.metadata['mainClass'],
+            'natives': self.natives,
+            'assets_index_name': self.metadata['assets'],
+            'version_type': self.metadata['type'],
+            'jvm': jvm,
+            'game': game
+        }
+
+    def save_plan(self, plan):
+        path = self.plan_path()
+        ensure_dir(os.path.dirname(path))
+
+        with replace_file(path) as fp:
+            json.dump(plan, fp)
+
+        return plan
+
+    def load_plan(self):
+        """Return the cached launch plan, or None if the metadata it was built from changed"""
+        try:
+            with open(self.plan_path()) as fp:
+                plan = json.load(fp)
+
+            metafile = self.meta_path()
+            st = os.stat(metafile)
+        except (OSError, ValueError):
+            return None
+
+        if not plan['meta_stat'] == [st.st_size, st.st_mtime_ns]:
+            # Touched, but possibly not changed
+            if not sha1_file(metafile) == plan['meta_sha1']:
+                return None
+
+            plan['meta_stat'] = [st.st_size, st.st_mtime_ns]
+            self.save_plan(plan)
+
+        if not os.path.isdir(plan['natives']):
+            return None
+
+        return plan
+
+    def launch_plan(self):
+        if not self.plan:
+            self.plan = self.load_plan()
+            default_metrics().count('plan.hits' if self.plan else 'plan.misses')
+
+            if not self.plan:
+                with default_metrics().timer('build_plan'):
+                    self.plan = self.save_plan(self.build_plan())
+
+        if not self.natives:
+            # A reused plan skips extract_natives, so the natives and the plan
+            # are touched here for storegc to see they are still in use
+            for path in (self.plan['natives'], self.plan_path()):
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+
+            self.natives = self.plan['natives']
+
+        return self.plan
+
+    def launch_values(self, plan):
+        values = {
             'version_name': self.version_name,
             'game_directory': self.game_dir,
             'assets_root': os.path.join(self.client_root, 'assets'),
-            'assets_index_name': self.metadata['assets'],
+            'assets_index_name': plan['assets_index_name'],
             'auth_uuid': self.authentication.uuid,
             'auth_access_token': self.authentication.access_token,
             'user_type': "legacy",
             'auth_player_name': self.authentication.player_name,
-            'version_type': self.metadata['type']
+            'version_type': plan['version_type'],
+            'natives_directory': plan['natives'],
+            'launcher_name': 'pymclaunch',
+            'launcher_version': '1.0',
+            'classpath': os.pathsep.join(plan['classpath'])
         }
-        classpath = ':'.join(self.library_paths)
-        launchclass = self.metadata['mainClass']
 
-        # Older arguments
-        if 'minecraftArguments' in self.metadata:
-            launchargs_raw = self.metadata['minecraftArguments']
-            jvmargs = self.jvm + ' -Djava.library.path=%s -cp %s %s ' % (self.natives, classpath, launchclass)
+        if 'width' in self.kwargv and 'height' in self.kwargv:
+            values['resolution_width'] = self.kwargv['width']
+            values['resolution_height'] = self.kwargv['height']
 
-            if 'width' in self.kwargv and 'height' in self.kwargv:
-                launchargs_raw += ' --width %d --height %d '% (self.kwargv['width'], self.kwargv['height'])
+        return values
 
-            if 'demo' in self.kwargv:
-                launchargs_raw += ' --demo '
+    def argfile(self, args):
+        """Write `args` to a cached @argfile, returning the arguments that replace them
 
-            gameargs = re.sub(r'\${', '{', launchargs_raw)
-            gameargs = gameargs.format(**gamefmt)
+        The file is named after its content, so it is written once and reused
+        by every launch with the same JVM options and classpath. JVMs before
+        Java 9 don't read argfiles and get `args` as they are."""
+        version = self.java_version()
+        if not self.use_argfile or version is None or version < 9 or not args:
+            return args
 
-            return jvmargs + gameargs
+        # One quoted argument per line; backslashes escape inside quotes
+        content = ''.join('"%s"\n' % (a.replace('\\', '\\\\').replace('"', '\\"')) for a in args)
+        path = os.path.join(self.version_directory, 'args',
+            '%s.txt' % (hashlib.sha1(content.encode('utf-8')).hexdigest()))
 
-        # New arguments system
-        if 'arguments' in self.metadata:
-            # GAME ARGUMENTS SETUP
-            argconstr = []
-            for argv in self.metadata['arguments']['game']:
-                if isinstance(argv, dict):
-                    if not self.kwargv:
-                        continue
-
-                    for rule in argv['rules']:
-                        if 'has_custom_resolution' in rule['features'] and 'width' in self.kwargv and 'height' in self.kwargv:
-                            argconstr += argv['value']
-                            gamefmt['resolution_width'] = self.kwargv['width']
-                            gamefmt['resolution_height'] = self.kwargv['height']
-                        elif 'is_demo_user' in rule['features'] and 'demo' in self.kwargv:
-                            argconstr.append(argv['value'])
-                else:
-                    argconstr.append(argv)
-            
-            gameargs = ' '.join(argconstr)
-            gameargs = re.sub(r'\${', '{', gameargs)
-            gameargs = gameargs.format(**gamefmt)
-
-            # JVM ARGUMENTS SETUP
-            jvargs = self.jvm.split(' ')
-            for x in self.metadata['arguments']['jvm']:
-                if isinstance(x, dict):
-                    for rule in argv['rules']:
-                        if 'os' in rule and rule['os']['name'] == platform():
-                            if rule['action'] == 'allow':
-                                if x['value'] is list:
-                                    jvargs += x['value']
-                                else:
-                                    jvargs.append(x['value'])
-                else:
-                    jvargs.append(x)
+        # Touched on reuse, so storegc sees it is still in use
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            ensure_dir(os.path.dirname(path))
+
+            with replace_file(path, encoding='utf-8') as fp:
+                fp.write(content)
+
+        return ['@' + path]
+
+    def command(self):
+        """Resolve the full command line: `argv`, plus the `argfile` it refers to and its `argfile_args`"""
+        plan = self.launch_plan()
+        values = self.launch_values(plan)
+
+        # Unknown placeholders are passed through untouched
+        def substitute(arg):
+            return re.sub(r'\$\{(\w+)\}', lambda m: str(values.get(m.group(1), m.group(0))), arg)
+
+        # Options carrying credentials never end up in a file on disk
+        shared = [substitute(a) for a in plan['jvm'] if '${auth_' not in a]
+        private = [substitute(a) for a in plan['jvm'] if '${auth_' in a]
+
+        jvm = self.argfile(shared)
+        argfile = jvm[0][1:] if jvm is not shared else None
+
+        argv = [self.java] + jvm + private + self.cds_args(plan) + [plan['main_class']] + \
+            [substitute(a) for a in plan['game']]
+
+        return {'argv': argv, 'argfile': argfile, 'argfile_args': shared if argfile else []}
+
+    def argv(self):
+        """The argument list to start the game with, `java` first"""
+        return self.command()['argv']
+
+    def launchargs(self):
+        # Only for display; spawn passes argv as a list
+        return ' '.join(self.argv()[1:])
+
+    def export_argv(self, path = None, redact = True):
+        """Dump the resolved command line as JSON, for debugging
 
-            jvmargs = ' '.join(jvargs)
-            jvmargs = re.sub(r'\${', '{', jvmargs)
-            jvmargs = jvmargs.format(natives_directory=self.natives, launcher_name='pymclaunch', launcher_version='1.0', 
-                classpath=classpath)
-            jvmargs += ' ' + launchclass
+        The access token is masked unless `redact` is False. Returns the
+        exported dict and writes it to `path` if given."""
+        command = dict(self.command(), cwd=self.game_dir)
+        token = self.authentication.access_token if self.authentication else None
 
-            return jvmargs + ' ' + gameargs
+        if redact and token:
+            mask = lambda args: [a.replace(token, '<access token>') for a in args]
+            command['argv'] = mask(command['argv'])
+            command['argfile_args'] = mask(command['argfile_args'])
+
+        if path:
+            with open(path, 'w') as fp:
+                json.dump(command, fp, indent=2)
+
+        return command
+
+    def prepare(self):
+        # A valid cached plan means this version is installed and its
+        # natives are extracted, so there is nothing to check, unless a fast
+        # start never got to finish the assets
+        self.plan = self.load_plan()
+        if not self.plan or os.path.exists(self.pending_path()):
+            self.install()
+            self.extract_natives()
 
-    def init_mc(self):
-        self.install()
-        self.extract_natives()
-        
         ensure_dir(self.game_dir)
 
-        launchargs = self.launchargs()
-        process = subprocess.Popen(launchargs.split(' '), cwd=self.game_dir, executable="java", 
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    def spawn(self):
+        """Start the game without waiting for it, returning the Popen object"""
+        return subprocess.Popen(self.argv(), cwd=self.game_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def init_mc(self, sinks = None):
+        """Install if needed, run the game and wait for it to exit.
+
+        Game output is captured in `log` (a LogCapture) and passed to `sinks`,
+        which default to printing every line. A summary of the metrics for
+        this launch is handed to the exporters of `default_metrics()` once
+        the game exits. Returns the exit code."""
+        with self.launch_summary() as summary:
+            self.prepare()
+            process = self.spawn()
+            summary.started()
+
+            self.log = LogCapture(process, sinks if sinks is not None else [PrintSink()])
+            self.log.wait()
+            summary.returncode = process.wait()
+
+            self.cleanup()
+
+        return summary.returncode
+
+    def launch_summary(self):
+        """A LaunchSummary for one launch of this client"""
+        return LaunchSummary(self)
+
+    async def launch_async(self, on_line = None):
+        """Install if needed, then run the game as an asyncio subprocess.
+
+        Every line of game output is passed to `on_line` (printed by default).
+        Like `init_mc`, hands a summary of the launch to the metrics exporters.
+        Returns the exit code of the game."""
+        loop = asyncio.get_running_loop()
+
+        with self.launch_summary() as summary:
+            await loop.run_in_executor(None, self.prepare)
+
+            argv = await loop.run_in_executor(None, self.argv)
+            process = await asyncio.create_subprocess_exec(*argv, cwd=self.game_dir,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            summary.started()
+
+            def emit(line):
+                line = line.rstrip().decode('utf-8', 'replace')
+                if on_line:
+                    on_line(line)
+                else:
+                    print(">>> " + line)
+
+            # Read in chunks and split the lines ourselves: readline() gives up
+            # on lines over 64 KiB, which Forge classpath and mod list dumps reach
+            rest = b''
+            while True:
+                chunk = await process.stdout.read(64 * 1024)
+                if not chunk:
+                    break
+
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+
+                for line in lines:
+                    emit(line)
+
+            if rest:
+                emit(rest)
 
-        for line in iter(process.stdout.readline, b''):
-            print(">>> " + line.rstrip().decode('utf-8'))
+            summary.returncode = await process.wait()
+            self.cleanup()
 
-        self.cleanup()
+        return summary.returncode
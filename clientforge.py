@@ -1,5 +1,4 @@
 import client
-import requests
 import os
 import io
 import re
@@ -7,49 +6,66 @@ import json
 import zipfile
 import lzma
 import shutil
+import hashlib
+import time
+import tempfile
 import subprocess
-from common import ensure_dir, save_to_file, platform, save_to_file_sha1
+from concurrent.futures import ThreadPoolExecutor
+from common import ensure_dir, fetch, platform, replace_file, CHUNK_SIZE
+from metrics import default_metrics
 
 mvn = 'http://files.minecraftforge.net/maven/'
 mclib = 'https://libraries.minecraft.net/'
 
 class MinecraftClientForge(client.MinecraftClient):
     """Launch a Minecraft Forge-enabled client"""
-    def __init__(self, clientRoot, mcVersion, forgeVersion, gamedir, authentication = None, jvm = None):
-        super(MinecraftClientForge, self).__init__(clientRoot, mcVersion, gamedir, authentication, jvm)
+    def __init__(self, clientRoot, mcVersion, forgeVersion, gamedir, authentication = None, jvm = None, workers = 8,
+            session = None, progress = None, store = None, resolver = None, cds = False, fast_start = None):
+        super(MinecraftClientForge, self).__init__(clientRoot, mcVersion, gamedir, authentication, jvm, workers, session,
+            progress, store, resolver, cds, fast_start)
         
         self.forge_version = forgeVersion
         self.forge_name = self.mcver + '-' + re.sub(r'^forge-', '', self.forge_version)
         self.version_name = self.mcver + '-' + self.forge_version
         self.version_directory = '%s/versions/%s' % (self.client_root, self.version_name)
         self.forge_metadata = None
+        self.tmp_dir = None
+        self.unpack_workers = os.cpu_count() or 1
+        self.unpack_pool = None
+        self.unpack_jobs = []
 
     def install_forge(self):
         if os.path.exists(self.version_directory):
             return
 
-        # Create a temporary files directory
-        self.tmp_dir = 'tmp'
-        ensure_dir(self.tmp_dir)
+        start = time.monotonic()
 
         # Make sure all the components are ready.
         self.install()
 
         forge_path = mvn + 'net/minecraftforge/forge/{name}/forge-{name}-universal.jar'.format(name = self.forge_name)
-        forge_target = os.path.join(self.tmp_dir, forge_path.split('/')[-1])
 
-        r = requests.get(forge_path, stream=True)
-        save_to_file(forge_target, r)
+        # The universal jar is the forge library itself, so it is stored under
+        # its maven path right away and get_libraries won't fetch it again.
+        forge_target = os.path.join(self.client_root, 'libraries',
+            'net/minecraftforge/forge/{name}/forge-{name}.jar'.format(name = self.forge_name))
 
-        print('Extracting forge archive ...')
-        zip_ref = zipfile.ZipFile(forge_target, 'r')
-        zip_ref.extractall(self.tmp_dir)
-        zip_ref.close()
+        if not os.path.exists(forge_target):
+            # Download into a private temporary directory so several forge
+            # installs can run at once without touching each other's files
+            ensure_dir(os.path.dirname(forge_target))
+            self.tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(forge_target), prefix='.forge-')
+
+            try:
+                tmp_target = os.path.join(self.tmp_dir, forge_path.split('/')[-1])
+                fetch(forge_path, tmp_target, session=self.session, progress=self.progress, resolver=self.resolver)
+                os.replace(tmp_target, forge_target)
+            finally:
+                self.clean_up()
 
         print('Reading forge metadata ...')
-        metafile = os.path.join(self.tmp_dir, 'version.json')
-        with open(metafile) as json_data:
-            self.forge_metadata = json.load(json_data)
+        with zipfile.ZipFile(forge_target, 'r') as zip_ref:
+            self.forge_metadata = json.loads(zip_ref.read('version.json').decode('utf-8'))
 
         if not self.forge_metadata['inheritsFrom'] == self.metadata['id']:
             raise ValueError('Versions mismatch! This forge version was made for Minecraft %s!' % (self.forge_metadata['inheritsFrom']))
@@ -114,52 +130,84 @@ class MinecraftClientForge(client.MinecraftClient):
 
         print('Library paths finished, saving to metadata ...')
 
-        self.metadata['libraries'] += libs
-        self.metadata['id'] = self.forge_metadata['id']
-        self.metadata['minecraftArguments'] = self.forge_metadata['minecraftArguments']
-        self.metadata['mainClass'] = self.forge_metadata['mainClass']
+        # The loaded metadata is shared, so build a new copy instead of editing it
+        self.metadata = dict(self.metadata,
+            libraries=self.metadata['libraries'] + libs,
+            id=self.forge_metadata['id'],
+            minecraftArguments=self.forge_metadata['minecraftArguments'],
+            mainClass=self.forge_metadata['mainClass'])
+        self.resolved = None
 
         self.save_metadata()
         self.get_libraries()
 
-        print('Cleaning up ...')
-
-        self.clean_up()
+        default_metrics().add_time('forge.install', time.monotonic() - start)
 
     def clean_up(self):
-        shutil.rmtree(self.tmp_dir)
+        if self.tmp_dir and os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+
+        self.tmp_dir = None
 
     def save_metadata(self):
-        with open(os.path.join(self.version_directory, '%s.json' % (self.version_name)), 'w') as fp:
+        with replace_file(self.meta_path()) as fp:
             json.dump(self.metadata, fp)
 
-    def unpack_lzma(self, file):
-        # Extract XZ
-        pack_path = re.sub(r'\.xz', '', file)
-
-        with lzma.open(file) as f:
-            fdata = f.read()
+    def get_libraries(self):
+        # .pack.xz libraries are unpacked on a worker pool while the
+        # remaining libraries keep downloading
+        self.unpack_jobs = []
 
-        # Find checksums in the file
-        x = len(fdata)
-        signflag = fdata[x - 4:]
-        lendata = ((fdata[x - 8] & 0xFF)) | ((fdata[x - 7] & 0xFF) << 8) | ((fdata[x - 6] & 0xFF) << 16) | ((fdata[x - 5] & 0xFF) << 24)
-        
-        if not signflag.decode('utf-8') == 'SIGN':
-            raise ValueError('Invalid file.')
+        with ThreadPoolExecutor(max_workers=self.unpack_workers) as pool:
+            self.unpack_pool = pool
 
-        # TODO: Checksum checking
-        checksums = fdata[x - lendata - 8:x-8].decode('utf-8')
+            try:
+                super(MinecraftClientForge, self).get_libraries()
+            finally:
+                self.unpack_pool = None
 
-        # Remove the checksum bytes
-        filedata = io.BytesIO(fdata[0 : x - lendata - 8])
+            for job in self.unpack_jobs:
+                job.result()
 
-        # Override the .pack
-        with open(pack_path, 'wb') as fp:
-            shutil.copyfileobj(filedata, fp, filedata.getbuffer().nbytes)
+    def unpack_lzma(self, file):
+        if self.unpack_pool:
+            self.unpack_jobs.append(self.unpack_pool.submit(self.unpack_timed, file))
+        else:
+            self.unpack_timed(file)
+
+    def unpack_timed(self, file):
+        with default_metrics().timer('forge.unpack'):
+            self.unpack_pack(file)
+
+    def unpack_pack(self, file):
+        # Extract XZ, streaming. The decompressed data ends with the checksums,
+        # their length (4 bytes, little endian) and the 'SIGN' marker. Only the
+        # last 8 bytes are held back; the checksums are cut off the file later.
+        pack_path = re.sub(r'\.xz$', '', file)
+        tail = b''
+
+        with lzma.open(file) as f, open(pack_path, 'w+b') as fp:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                data = tail + block
+                fp.write(data[:-8])
+                tail = data[-8:]
+
+            if len(tail) < 8 or not tail[4:] == b'SIGN':
+                raise ValueError('Invalid file.')
+
+            lendata = int.from_bytes(tail[:4], 'little')
+            size = fp.tell()
+
+            if lendata > size:
+                raise ValueError('Invalid file.')
+
+            # Read the checksums back and remove them from the .pack
+            fp.seek(size - lendata)
+            checksums = fp.read(lendata)
+            fp.truncate(size - lendata)
 
         # Unpack200
-        jar = re.sub(r'\.pack', '', pack_path)
+        jar = re.sub(r'\.pack$', '', pack_path)
         ret = subprocess.run(['unpack200', pack_path, jar])
         if ret.returncode:
             raise Exception('unpack200 failed or is missing! Make sure java is installed and in your $PATH!')
@@ -167,3 +215,36 @@ class MinecraftClientForge(client.MinecraftClient):
         # Clean up
         os.remove(file)
         os.remove(pack_path)
+
+        try:
+            self.verify_jar(jar, checksums)
+        except Exception:
+            os.remove(jar)
+            raise
+
+    def verify_jar(self, jar, checksums):
+        # The checksums are "<sha1> <entry>" lines, either as plain text or in
+        # a checksums.sha1 file inside a small zip
+        if checksums.startswith(b'PK'):
+            with zipfile.ZipFile(io.BytesIO(checksums)) as zip_ref:
+                checksums = zip_ref.read('checksums.sha1')
+
+        expected = {}
+        for line in checksums.decode('utf-8').splitlines():
+            entry = line.strip().split(' ', 1)
+            if len(entry) == 2:
+                expected[entry[1]] = entry[0]
+
+        with zipfile.ZipFile(jar, 'r') as zip_ref:
+            for name, sha1 in expected.items():
+                hash_sha1 = hashlib.sha1()
+
+                try:
+                    with zip_ref.open(name) as entry:
+                        for block in iter(lambda: entry.read(CHUNK_SIZE), b''):
+                            hash_sha1.update(block)
+                except KeyError:
+                    raise ValueError('Unpacked %s is missing %s!' % (jar, name))
+
+                if not hash_sha1.hexdigest() == sha1:
+                    raise ValueError('The checksum of %s in %s DID NOT MATCH!' % (name, jar))
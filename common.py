@@ -1,6 +1,27 @@
 import os, errno
 import sys
 import hashlib
+import functools
+import threading
+import contextlib
+import tempfile
+import time
+from transport import default_session
+from sources import is_remote
+from progress import ProgressEvent, BatchProgress, default_progress
+from metrics import default_metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Read size for downloads, used when no chunk_size is given
+CHUNK_SIZE = 64 * 1024
+
+_part_locks = {}
+_part_locks_lock = threading.Lock()
 
 def ensure_dir(path):
     try:
@@ -9,53 +30,235 @@ def ensure_dir(path):
         if e.errno != errno.EEXIST:
             raise
 
-def save_to_file(path, response):
-    file_name = path.split('/')[-1]
-    size = int(response.headers['content-length'].strip())
-    bytesdl = 0
+@contextlib.contextmanager
+def replace_file(path, mode = 'w', perms = 0o644, **kwargs):
+    """Open a temporary file next to `path` and move it over `path` once written
 
-    with open(path, 'wb') as handle:
-        for block in response.iter_content(1024):
-            handle.write(block)
-            bytesdl += len(block)
+    Every caller gets its own temporary file, so threads and processes
+    writing the same path at once never get in each other's way."""
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.%s.' % (name), suffix='.tmp')
+
+    try:
+        os.chmod(tmp, perms)
 
-            sys.stdout.write('\rDownloading %s - %s MB of %s MB' % (
-                file_name, str(round(bytesdl / 1024 / 1024, 2))[:4],
-                str(round(size / 1024 / 1024, 2))[:4]))
-            sys.stdout.flush()
+        with os.fdopen(fd, mode, **kwargs) as fp:
+            yield fp
 
-    sys.stdout.write('\rDownloaded file %s successfully!' % (file_name) + ' ' * (len(file_name) + 10) + '\n')
-    sys.stdout.flush()
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
-    return path
+@contextlib.contextmanager
+def claim(part):
+    # Hold an exclusive lock on a .part file so two downloads of the same
+    # file, from threads or other processes, never write to it at once.
+    # Yields whether we had to wait for another download to finish.
+    waited = False
+
+    if not fcntl:
+        with _part_locks_lock:
+            lock = _part_locks.setdefault(part, threading.Lock())
+
+        waited = not lock.acquire(False)
+        if waited:
+            lock.acquire()
+
+        try:
+            open(part, 'ab').close()
+            yield waited
+        finally:
+            lock.release()
+        return
+
+    while True:
+        fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            waited = True
+            fcntl.flock(fd, fcntl.LOCK_EX)
 
-def save_to_file_sha1(path, response, checksum):
+        # The previous holder may have renamed or removed the file we locked
+        try:
+            if os.fstat(fd).st_ino == os.stat(part).st_ino:
+                break
+        except OSError:
+            pass
+
+        os.close(fd)
+
+    try:
+        yield waited
+    finally:
+        os.close(fd)
+
+def _save(path, blocks, size, checksum = None, progress = None, offset = 0):
+    # Everything is written to a .part file first and only renamed into
+    # place once complete (and verified), so an interrupted download never
+    # leaves a truncated file behind at `path`.
     file_name = path.split('/')[-1]
-    size = int(response.headers['content-length'].strip())
-    bytesdl = 0
+    part = path + '.part'
+    size = offset + size
+    bytesdl = offset
     hash_sha1 = hashlib.sha1()
+    mode = 'wb'
+    start = time.monotonic()
+
+    if progress is None:
+        progress = default_progress()
+
+    if offset:
+        # Resuming: the digest has to cover the bytes we already have
+        with open(part, 'rb') as handle:
+            for block in iter(lambda: handle.read(65536), b''):
+                hash_sha1.update(block)
+        mode = 'ab'
+
+    def event(done):
+        elapsed = time.monotonic() - start
+        rate = (bytesdl - offset) / elapsed if elapsed > 0 else 0
+        return ProgressEvent(file_name, bytesdl, size, rate, done)
 
-    with open(path, 'wb') as handle:
-        for block in response.iter_content(1024):
+    with open(part, mode) as handle:
+        for block in blocks:
             handle.write(block)
             hash_sha1.update(block)
             bytesdl += len(block)
 
-            sys.stdout.write('\rDownloading %s - %s MB of %s MB' % (
-                file_name, str(round(bytesdl / 1024 / 1024, 2))[:4],
-                str(round(size / 1024 / 1024, 2))[:4]))
-            sys.stdout.flush()
+            progress(event(False))
 
-    sys.stdout.write('\rDownloaded file %s successfully!' % (file_name) + ' ' * (len(file_name) + 10) + '\n')
-    sys.stdout.flush()
+    default_metrics().count('download.bytes', bytesdl - offset)
 
-    digest = hash_sha1.hexdigest()
-    if not digest == checksum:
-        os.remove(path)
-        raise Warning('The checksum on this file DID NOT MATCH! Please try again later.')
+    if checksum:
+        digest = hash_sha1.hexdigest()
+        if not digest == checksum:
+            os.remove(part)
+            raise Warning('The checksum on this file DID NOT MATCH! Please try again later.')
+
+    os.replace(part, path)
+    progress(event(True))
 
     return path
 
+def _length(response):
+    return int(response.headers.get('content-length', '0').strip())
+
+def save_to_file(path, response, progress = None, chunk_size = None):
+    return _save(path, response.iter_content(chunk_size or CHUNK_SIZE), _length(response), None, progress)
+
+def save_to_file_sha1(path, response, checksum, progress = None, chunk_size = None):
+    return _save(path, response.iter_content(chunk_size or CHUNK_SIZE), _length(response), checksum, progress)
+
+def fetch(url, path, checksum = None, session = None, progress = None, chunk_size = None, resolver = None):
+    """Download `url` to `path`, resuming a previous partial download.
+
+    A leftover `path`.part is continued with an HTTP Range request. If the
+    server ignores the range the download starts over from zero.
+
+    With a `resolver`, every location it maps `url` to (mirrors first) is
+    tried in turn until one succeeds."""
+    locations = resolver.candidates(url) if resolver else [url]
+    if not locations:
+        raise IOError('%s is not available offline!' % (url))
+
+    for location in locations:
+        try:
+            if is_remote(location):
+                return _fetch_remote(location, path, checksum, session, progress, chunk_size)
+
+            return _fetch_local(location, path, checksum, progress, chunk_size)
+        except (IOError, Warning):
+            # requests' errors are IOErrors too
+            if location == locations[-1]:
+                raise
+
+def _fetch_local(source, path, checksum, progress, chunk_size):
+    part = path + '.part'
+
+    # Opened before the .part is claimed, so a file missing from the mirror
+    # leaves no empty .part behind
+    with open(source, 'rb') as handle, claim(part) as waited:
+        if waited and os.path.exists(path):
+            os.remove(part)
+            return path
+
+        default_metrics().count('download.local')
+
+        blocks = iter(lambda: handle.read(chunk_size or CHUNK_SIZE), b'')
+        return _save(path, blocks, os.fstat(handle.fileno()).st_size, checksum, progress)
+
+def _fetch_remote(url, path, checksum, session, progress, chunk_size):
+    if session is None:
+        session = default_session()
+
+    part = path + '.part'
+
+    with claim(part) as waited:
+        # Somebody else was downloading the same file and has finished it
+        if waited and os.path.exists(path):
+            os.remove(part)
+            return path
+
+        offset = os.path.getsize(part)
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+
+        r = session.get(url, stream=True, headers=headers)
+        default_metrics().count('download.requests')
+
+        if offset and r.status_code == 416:
+            # The partial file is no use to us, start from scratch
+            r.close()
+            os.truncate(part, 0)
+            offset = 0
+            r = session.get(url, stream=True)
+            default_metrics().count('download.requests')
+
+        r.raise_for_status()
+
+        if r.status_code != 206:
+            offset = 0
+        else:
+            default_metrics().count('download.resumed')
+
+        return _save(path, r.iter_content(chunk_size or CHUNK_SIZE), _length(r), checksum, progress, offset)
+
+def download_all(jobs, workers = 8, label = 'files', session = None, progress = None, chunk_size = None,
+        resolver = None):
+    """Download (url, path, sha1) jobs with at most `workers` requests in flight.
+
+    Jobs that point at the same path are only fetched once. Returns the
+    list of downloaded paths."""
+    if session is None:
+        session = default_session()
+
+    unique = {}
+    for url, path, checksum in jobs:
+        unique.setdefault(path, (url, checksum))
+
+    total = len(unique)
+    if not total:
+        return []
+
+    batch = BatchProgress(progress or default_progress(), label, total)
+
+    def run(path, url, checksum):
+        return fetch(url, path, checksum, session, batch, chunk_size, resolver)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(run, path, url, checksum) for path, (url, checksum) in unique.items()]
+        paths = [f.result() for f in as_completed(futures)]
+
+    batch.finish()
+
+    return paths
+
+@functools.lru_cache(maxsize=None)
 def platform():
     pf = sys.platform
     if pf == 'linux' or pf == 'cygwin':
@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import functools
+import subprocess
+import threading
+
+_cache_lock = threading.Lock()
+
+def parse_version(output):
+    """Major version from `java -version` output: 8 for "1.8.0_292", 17 for "17.0.2" """
+    match = re.search(r'version "(\d+)(?:\.(\d+))?[^"]*"', output)
+    if not match:
+        return None
+
+    major = int(match.group(1))
+    if major == 1 and match.group(2):
+        return int(match.group(2))
+
+    return major
+
+@functools.lru_cache(maxsize=None)
+def _probe(path, mtime):
+    try:
+        ret = subprocess.run([path, '-version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    return parse_version(ret.stdout.decode('utf-8', 'replace'))
+
+def java_version(java = 'java', cache = None):
+    """Major version of the `java` executable, or None if it can't be run
+
+    Running `java -version` takes a JVM start, so the result is remembered
+    per binary (by real path and mtime) for this process and, given a
+    `cache` file, across processes."""
+    path = shutil.which(java)
+    if not path:
+        return None
+
+    path = os.path.realpath(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    if not cache:
+        return _probe(path, mtime)
+
+    with _cache_lock:
+        try:
+            with open(cache) as fp:
+                known = json.load(fp)
+        except (OSError, ValueError):
+            known = {}
+
+        if path in known and known[path][0] == mtime:
+            return known[path][1]
+
+        version = _probe(path, mtime)
+        known[path] = [mtime, version]
+
+        tmp = '%s.%d.tmp' % (cache, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump(known, fp)
+        os.replace(tmp, cache)
+
+    return version
+
+def default_jvm(version, heap = '1G'):
+    """JVM options for the given Java major version
+
+    CMS only exists up to Java 13 and its incremental mode up to Java 8, so
+    everything from Java 8 on gets G1 tuned for short pauses (the profile
+    the official launcher uses). When the version is unknown we assume a
+    current JVM."""
+    if version is not None and version < 8:
+        return '-Xmx%s -XX:+UseConcMarkSweepGC -XX:+CMSIncrementalMode -XX:-UseAdaptiveSizePolicy -Xmn128M' % (heap)
+
+    return ('-Xmx%s -XX:+UnlockExperimentalVMOptions -XX:+UseG1GC -XX:G1NewSizePercent=20 -XX:G1ReservePercent=20 '
+        '-XX:MaxGCPauseMillis=50 -XX:G1HeapRegionSize=32M' % (heap))
+
+def cds_archive(directory, classpath, java = 'java', version = None):
+    """Path of the AppCDS archive for a classpath and JVM, under `directory`
+
+    The name is a hash of both, so a changed classpath or Java update gets
+    a new archive instead of a stale one."""
+    key = json.dumps([classpath, os.path.realpath(shutil.which(java) or java), version])
+    return os.path.join(directory, '%s.jsa' % (hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+def cds_options(version, archive, dump = None):
+    """JVM options to use (or create) the dynamic AppCDS archive `archive`
+
+    Java 19+ creates and refreshes the archive by itself. Java 13 to 18
+    use it once it exists; until then the classes loaded during the run
+    are written to `dump` (by default the archive itself) when the JVM
+    exits. Older JVMs have no dynamic archives and get no options."""
+    if version is None or version < 13:
+        return []
+
+    if version >= 19:
+        return ['-XX:+AutoCreateSharedArchive', '-XX:SharedArchiveFile=%s' % (archive)]
+
+    if os.path.exists(archive):
+        return ['-XX:SharedArchiveFile=%s' % (archive)]
+
+    return ['-XX:ArchiveClassesAtExit=%s' % (dump or archive)]
@@ -0,0 +1,157 @@
+import os
+import re
+import sys
+import time
+import queue
+import threading
+from collections import deque, namedtuple
+
+LogRecord = namedtuple('LogRecord', ['time', 'stream', 'level', 'thread', 'message', 'raw'])
+
+# [12:34:56] [Client thread/INFO]: message
+log_format = re.compile(r'^\[(?P<time>[\d:]+)\] \[(?P<thread>[^\]]*)/(?P<level>[A-Z]+)\]: ?(?P<message>.*)$')
+
+levels = ['TRACE', 'DEBUG', 'INFO', 'WARN', 'ERROR', 'FATAL']
+
+def parse_line(stream, raw):
+    match = log_format.match(raw)
+    if match:
+        return LogRecord(time.time(), stream, match.group('level'), match.group('thread'), match.group('message'), raw)
+
+    # Anything unstructured on stderr is most likely a stack trace
+    return LogRecord(time.time(), stream, 'ERROR' if stream == 'stderr' else 'INFO', None, raw, raw)
+
+class PrintSink(object):
+    """Print every line with a prefix, the way init_mc always has"""
+    def __init__(self, prefix = '>>> ', stream = None):
+        super(PrintSink, self).__init__()
+        self.prefix = prefix
+        self.stream = stream or sys.stdout
+
+    def __call__(self, record):
+        self.stream.write(self.prefix + record.raw + '\n')
+        self.stream.flush()
+
+class FileSink(object):
+    """Append lines to a file, rotating it once it grows past `max_bytes`"""
+    def __init__(self, path, max_bytes = 10 * 1024 ** 2, backups = 3):
+        super(FileSink, self).__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.handle = open(path, 'a', encoding='utf-8')
+
+    def rotate(self):
+        self.handle.close()
+
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, i)):
+                os.replace('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+        self.handle = open(self.path, 'a', encoding='utf-8')
+
+    def __call__(self, record):
+        self.handle.write(record.raw + '\n')
+        self.handle.flush()
+
+        if self.handle.tell() >= self.max_bytes:
+            self.rotate()
+
+    def close(self):
+        self.handle.close()
+
+class LevelFilter(object):
+    """Only pass records of `level` or more severe on to `sink`"""
+    def __init__(self, sink, level = 'WARN'):
+        super(LevelFilter, self).__init__()
+        self.sink = sink
+        self.minimum = levels.index(level)
+
+    def __call__(self, record):
+        if record.level in levels and levels.index(record.level) >= self.minimum:
+            self.sink(record)
+
+class LogCapture(object):
+    """Drain a game's stdout and stderr in the background
+
+    Lines are parsed into LogRecords, kept in a ring buffer of the last
+    `maxlen` records and handed to every sink (any callable taking a
+    LogRecord) from a separate thread. The pipes are always drained
+    promptly, even when a sink is slow; if a sink falls more than
+    `backlog` records behind, records are dropped for the sinks and
+    counted in `dropped`."""
+    def __init__(self, process, sinks = None, maxlen = 1000, backlog = 10000):
+        super(LogCapture, self).__init__()
+        self.process = process
+        self.sinks = sinks or []
+        self.records = deque(maxlen=maxlen)
+        self.counts = dict((level, 0) for level in levels)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(backlog)
+        self.readers = []
+
+        for stream in ('stdout', 'stderr'):
+            pipe = getattr(process, stream)
+            if pipe is None:
+                continue
+
+            reader = threading.Thread(target=self.read, args=(stream, pipe), name='log-%s' % (stream), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+
+        self.dispatcher = threading.Thread(target=self.dispatch, name='log-sinks', daemon=True)
+        self.dispatcher.start()
+
+    def read(self, stream, pipe):
+        for line in iter(pipe.readline, b''):
+            record = parse_line(stream, line.rstrip().decode('utf-8', 'replace'))
+
+            with self.lock:
+                self.records.append(record)
+                if record.level in self.counts:
+                    self.counts[record.level] += 1
+
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+
+        pipe.close()
+
+    def dispatch(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+
+            for sink in self.sinks:
+                try:
+                    sink(record)
+                except Exception as e:
+                    print('Log sink %r failed: %s' % (sink, e))
+
+    def tail(self, lines = 20, level = None):
+        """The last `lines` records, optionally only those of `level` or more severe"""
+        with self.lock:
+            records = list(self.records)
+
+        if level:
+            minimum = levels.index(level)
+            records = [r for r in records if r.level in levels and levels.index(r.level) >= minimum]
+
+        return records[-lines:]
+
+    def wait(self):
+        """Block until the game closed its output and every record reached the sinks"""
+        for reader in self.readers:
+            reader.join()
+
+        self.queue.put(None)
+        self.dispatcher.join()
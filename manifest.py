@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import threading
+from common import ensure_dir, fetch, save_to_file, claim, replace_file
+from transport import default_session
+from metrics import default_metrics
+
+manifest_url = 'https://launchermeta.mojang.com/mc/game/version_manifest.json'
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+def load_json(path):
+    """Parse a JSON file at most once per process while it is unchanged on disk.
+
+    The returned object is shared between callers and must not be modified."""
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime_ns)
+
+    with _memo_lock:
+        hit = _memo.get(path)
+        if hit and hit[0] == key:
+            return hit[1]
+
+    with open(path) as json_data:
+        data = json.load(json_data)
+
+    with _memo_lock:
+        _memo[path] = (key, data)
+
+    return data
+
+def _read_info(path):
+    try:
+        with open(path + '.cache') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+def _write_info(path, info):
+    with replace_file(path + '.cache') as fp:
+        json.dump(info, fp)
+
+def is_fresh(path, ttl):
+    """Whether `path` was downloaded or revalidated less than `ttl` seconds ago"""
+    return os.path.exists(path) and time.time() - _read_info(path).get('checked', 0) < ttl
+
+def revalidate(url, path, ttl, session = None, progress = None, resolver = None):
+    """Keep `path` an up to date copy of `url`.
+
+    Within `ttl` seconds of the last check the cached file is used as is.
+    After that it is revalidated with If-None-Match / If-Modified-Since and
+    only downloaded again if it changed. When mirrors or offline mode are in
+    use the file is only downloaded when missing."""
+    if is_fresh(path, ttl):
+        return path
+
+    if resolver and (resolver.mirrors or resolver.offline):
+        if not os.path.exists(path):
+            fetch(url, path, session=session, progress=progress, resolver=resolver)
+        return path
+
+    if session is None:
+        session = default_session()
+
+    part = path + '.part'
+
+    with claim(part) as waited:
+        # Revalidated by somebody else while we were waiting
+        if waited and is_fresh(path, ttl):
+            os.remove(part)
+            return path
+
+        info = _read_info(path)
+        headers = {}
+
+        if os.path.exists(path) and info.get('url') == url:
+            if 'etag' in info:
+                headers['If-None-Match'] = info['etag']
+            if 'last_modified' in info:
+                headers['If-Modified-Since'] = info['last_modified']
+
+        try:
+            r = session.get(url, stream=True, headers=headers)
+            default_metrics().count('download.requests')
+
+            if r.status_code == 304:
+                default_metrics().count('manifest.not_modified')
+            else:
+                r.raise_for_status()
+                save_to_file(path, r, progress)
+
+                info = {'url': url}
+                if 'etag' in r.headers:
+                    info['etag'] = r.headers['etag']
+                if 'last-modified' in r.headers:
+                    info['last_modified'] = r.headers['last-modified']
+        except IOError:
+            # Better a stale copy than no launch at all
+            if not os.path.exists(path):
+                raise
+
+            print('Failed to revalidate %s, using the cached copy.' % (url))
+
+        info['checked'] = time.time()
+        _write_info(path, info)
+
+        # Nothing was downloaded, drop the placeholder left by claim()
+        if os.path.exists(part):
+            os.remove(part)
+
+    return path
+
+class VersionManifest(object):
+    """The upstream list of Minecraft versions, cached on disk"""
+    def __init__(self, cache_dir, session = None, ttl = 3600, progress = None, resolver = None):
+        super(VersionManifest, self).__init__()
+        self.path = os.path.join(cache_dir, 'version_manifest.json')
+        self.session = session
+        self.ttl = ttl
+        self.progress = progress
+        self.resolver = resolver
+
+    def load(self):
+        ensure_dir(os.path.dirname(self.path))
+        revalidate(manifest_url, self.path, self.ttl, self.session, self.progress, self.resolver)
+
+        return load_json(self.path)
+
+    def versions(self, release_type = None):
+        return [v for v in self.load()['versions'] if not release_type or v['type'] == release_type]
+
+    def latest(self, release_type = 'release'):
+        return self.load()['latest'][release_type]
+
+    def url(self, version):
+        for v in self.load()['versions']:
+            if v['id'] == version:
+                return v['url']
+
+        return None
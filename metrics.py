@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+import contextlib
+
+class Metrics(object):
+    """Counters and timers for the launcher's hot paths
+
+    Counters are running totals (bytes downloaded, requests, cache hits and
+    misses), timers keep how often a stage ran and the seconds spent in it.
+    `summary` hands a record of them to every exporter, which can be any
+    callable taking a dict."""
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.exporters = []
+
+    def count(self, name, value = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            count, total = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (count + 1, total + seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.add_time(name, time.monotonic() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': dict((name, {'count': c, 'seconds': s}) for name, (c, s) in self.timers.items())
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+
+    def summary(self, event, since = None, **fields):
+        """Pass a record of the metrics to every exporter and return it.
+
+        `counters` and `timers` only cover what happened after the `since`
+        snapshot, if given; `totals` always holds everything so far."""
+        totals = self.snapshot()
+        record = dict(fields, event=event, time=time.time(), totals=totals)
+
+        if since:
+            record['counters'] = dict((name, value - since['counters'].get(name, 0))
+                for name, value in totals['counters'].items())
+            record['timers'] = {}
+
+            for name, timer in totals['timers'].items():
+                before = since['timers'].get(name, {'count': 0, 'seconds': 0.0})
+                record['timers'][name] = {'count': timer['count'] - before['count'],
+                    'seconds': timer['seconds'] - before['seconds']}
+        else:
+            record['counters'] = totals['counters']
+            record['timers'] = totals['timers']
+
+        for exporter in list(self.exporters):
+            try:
+                exporter(record)
+            except Exception as e:
+                print('Metrics exporter %r failed: %s' % (exporter, e))
+
+        return record
+
+class JsonExporter(object):
+    """Append every record as one line of JSON to a file (or stdout)"""
+    def __init__(self, path = None):
+        super(JsonExporter, self).__init__()
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+
+        with self.lock:
+            if self.path is None:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+                return
+
+            with open(self.path, 'a') as fp:
+                fp.write(line)
+
+class PrometheusExporter(object):
+    """Write the running totals in the Prometheus text format
+
+    Meant for node_exporter's textfile collector: the file is replaced
+    atomically on every record, so it is never read half-written."""
+    def __init__(self, path, prefix = 'pymclaunch'):
+        super(PrometheusExporter, self).__init__()
+        self.path = path
+        self.prefix = prefix
+        self.lock = threading.Lock()
+
+    def name(self, metric):
+        return '%s_%s' % (self.prefix, re.sub(r'[^a-zA-Z0-9_]', '_', metric))
+
+    def __call__(self, record):
+        totals = record['totals']
+        lines = []
+
+        for metric, value in sorted(totals['counters'].items()):
+            name = self.name(metric) + '_total'
+            lines += ['# TYPE %s counter' % (name), '%s %s' % (name, value)]
+
+        for metric, timer in sorted(totals['timers'].items()):
+            name = self.name(metric) + '_seconds'
+            lines += ['# TYPE %s summary' % (name), '%s_count %d' % (name, timer['count']),
+                '%s_sum %f' % (name, timer['seconds'])]
+
+        with self.lock:
+            tmp = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(tmp, 'w') as fp:
+                fp.write('\n'.join(lines) + '\n')
+            os.replace(tmp, self.path)
+
+_default = Metrics()
+
+def default_metrics():
+    return _default
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+import os
+import json
+from optparse import OptionParser
+from client import meta_url, asset_url
+from common import ensure_dir, fetch, download_all
+from sources import mirror_location
+from manifest import manifest_url, load_json
+
+def version_files(metadata):
+    """Every (url, sha1) a version may need, for all platforms"""
+    client_dl = metadata['downloads']['client']
+    files = [(client_dl['url'], client_dl.get('sha1'))]
+
+    for lib in metadata['libraries']:
+        dl = lib.get('downloads', {})
+
+        if 'artifact' in dl:
+            files.append((dl['artifact']['url'], dl['artifact'].get('sha1')))
+
+        for classifier in dl.get('classifiers', {}).values():
+            files.append((classifier['url'], classifier.get('sha1')))
+
+    return files
+
+def populate(mirror, versions, workers = 8, session = None, progress = None):
+    """Download everything needed to install `versions` into a mirror directory"""
+    manifest_file = mirror_location(mirror, manifest_url)
+    ensure_dir(os.path.dirname(manifest_file))
+    fetch(manifest_url, manifest_file, session=session, progress=progress)
+
+    urls = dict((v['id'], v['url']) for v in load_json(manifest_file)['versions'])
+
+    for version in versions:
+        url = urls.get(version, meta_url.format(version=version))
+        metafile = mirror_location(mirror, url)
+        ensure_dir(os.path.dirname(metafile))
+        fetch(url, metafile, session=session, progress=progress)
+
+        with open(metafile) as json_data:
+            metadata = json.load(json_data)
+
+        asset_index = metadata['assetIndex']
+        index_file = mirror_location(mirror, asset_index['url'])
+        ensure_dir(os.path.dirname(index_file))
+        fetch(asset_index['url'], index_file, asset_index['sha1'], session, progress)
+
+        with open(index_file) as json_data:
+            assets = json.load(json_data)
+
+        files = version_files(metadata)
+        for data in assets['objects'].values():
+            files.append((asset_url.format(prefix=data['hash'][0:2], hash=data['hash']), data['hash']))
+
+        jobs = []
+        for file_url, sha1 in files:
+            target = mirror_location(mirror, file_url)
+            if os.path.exists(target):
+                continue
+
+            ensure_dir(os.path.dirname(target))
+            jobs.append((file_url, target, sha1))
+
+        download_all(jobs, workers, version, session, progress)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='usage: %prog [options] mirror_dir version [version ...]')
+    parser.add_option('-w', '--workers', dest='workers', type='int', default=8,
+        help='Maximum number of concurrent downloads (default: 8)')
+
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error('A mirror directory and at least one version are required')
+
+    populate(args[0], args[1:], options.workers)
@@ -0,0 +1,112 @@
+import sys
+import json
+import time
+import threading
+from collections import namedtuple
+
+# bytes/total are in bytes (total is 0 when unknown), rate is bytes per second.
+# files/files_total are only set for batch downloads.
+ProgressEvent = namedtuple('ProgressEvent', ['name', 'bytes', 'total', 'rate', 'done', 'files', 'files_total'])
+ProgressEvent.__new__.__defaults__ = (None, None)
+
+def _mb(value):
+    return str(round(value / 1024 / 1024, 2))[:4]
+
+class SilentProgress(object):
+    """Progress reporter that drops every event"""
+    def __call__(self, event):
+        pass
+
+class TerminalProgress(object):
+    """Render progress on a terminal line, at most once every `interval` seconds"""
+    def __init__(self, interval = 0.2, stream = None):
+        super(TerminalProgress, self).__init__()
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.last = 0
+
+    def __call__(self, event):
+        now = time.monotonic()
+
+        with self.lock:
+            if not event.done and now - self.last < self.interval:
+                return
+
+            self.last = now
+
+            if event.files_total is not None:
+                line = '%s - %d of %d (%s MB, %s MB/s)' % (event.name, event.files, event.files_total,
+                    _mb(event.bytes), _mb(event.rate))
+            else:
+                line = '%s - %s MB of %s MB (%s MB/s)' % (event.name, _mb(event.bytes), _mb(event.total),
+                    _mb(event.rate))
+
+            if event.done:
+                self.stream.write('\rDownloaded %s successfully!' % (line) + ' ' * 10 + '\n')
+            else:
+                self.stream.write('\rDownloading %s' % (line))
+
+            self.stream.flush()
+
+class JsonProgress(object):
+    """Write one JSON object per line, at most once every `interval` seconds per name"""
+    def __init__(self, interval = 1.0, stream = None):
+        super(JsonProgress, self).__init__()
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.last = {}
+
+    def __call__(self, event):
+        now = time.monotonic()
+
+        with self.lock:
+            if not event.done and now - self.last.get(event.name, 0) < self.interval:
+                return
+
+            if event.done:
+                self.last.pop(event.name, None)
+            else:
+                self.last[event.name] = now
+
+            record = dict(event._asdict(), time=time.time())
+            self.stream.write(json.dumps(record) + '\n')
+            self.stream.flush()
+
+class BatchProgress(object):
+    """Fold the progress of many concurrent downloads into a single stream of events"""
+    def __init__(self, reporter, name, files_total):
+        super(BatchProgress, self).__init__()
+        self.reporter = reporter
+        self.name = name
+        self.files_total = files_total
+        self.files = 0
+        self.bytes = 0
+        self.seen = {}
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            self.bytes += event.bytes - self.seen.get(event.name, 0)
+            self.seen[event.name] = event.bytes
+
+            if event.done:
+                del self.seen[event.name]
+                self.files += 1
+
+            self.reporter(self.event(False))
+
+    def event(self, done):
+        elapsed = time.monotonic() - self.start
+        rate = self.bytes / elapsed if elapsed > 0 else 0
+        return ProgressEvent(self.name, self.bytes, 0, rate, done, self.files, self.files_total)
+
+    def finish(self):
+        self.reporter(self.event(True))
+
+_default = TerminalProgress()
+
+def default_progress():
+    return _default
@@ -0,0 +1,98 @@
+import re
+import sys
+import functools
+import platform as pyplatform
+from collections import namedtuple
+from common import platform
+
+# A version's libraries resolved for this machine. Every entry is a
+# (library, artifact) pair; `classpath` and `natives` are subsets of
+# `downloads`.
+ResolvedLibraries = namedtuple('ResolvedLibraries', ['downloads', 'classpath', 'natives'])
+
+@functools.lru_cache(maxsize=None)
+def os_info():
+    version = pyplatform.release()
+    if platform() == 'osx':
+        version = pyplatform.mac_ver()[0] or version
+    elif platform() == 'windows':
+        version = pyplatform.version() or version
+
+    arch = 'x86' if sys.maxsize <= 2 ** 32 else pyplatform.machine().lower()
+
+    return {'name': platform(), 'version': version, 'arch': arch}
+
+def rule_matches(rule, features = None):
+    info = os_info()
+
+    if 'os' in rule:
+        osrule = rule['os']
+
+        if 'name' in osrule and not osrule['name'] == info['name']:
+            return False
+        if 'version' in osrule and not re.search(osrule['version'], info['version']):
+            return False
+        if 'arch' in osrule and not osrule['arch'] == info['arch']:
+            return False
+
+    if 'features' in rule:
+        features = features or {}
+        for feature, value in rule['features'].items():
+            if not features.get(feature, False) == value:
+                return False
+
+    return True
+
+def rules_allow(rules, features = None):
+    """Apply a rule list the way the official launcher does.
+
+    No rules means allowed. Otherwise everything starts out disallowed and the
+    last matching rule decides."""
+    if not rules:
+        return True
+
+    allowed = False
+    for rule in rules:
+        if rule_matches(rule, features):
+            allowed = rule['action'] == 'allow'
+
+    return allowed
+
+def resolve_libraries(libraries):
+    """Compile a version's library list into the entries that apply to this platform"""
+    downloads = []
+    classpath = []
+    natives = []
+    bits = '32' if os_info()['arch'] == 'x86' else '64'
+
+    for lib in libraries:
+        if not rules_allow(lib.get('rules')):
+            continue
+
+        # Skip non-download-included for now
+        if not 'downloads' in lib:
+            continue
+
+        dl = lib['downloads']
+
+        if 'natives' in lib:
+            if platform() in lib['natives']:
+                platform_native = lib['natives'][platform()].replace('${arch}', bits)
+
+                if platform_native in dl.get('classifiers', {}):
+                    entry = (lib, dl['classifiers'][platform_native])
+                    downloads.append(entry)
+                    natives.append(entry)
+        elif 'classifiers' in dl and 'natives-' + platform() in dl['classifiers']:
+            entry = (lib, dl['classifiers']['natives-' + platform()])
+            downloads.append(entry)
+            classpath.append(entry)
+
+        if not 'artifact' in dl:
+            continue
+
+        entry = (lib, dl['artifact'])
+        downloads.append(entry)
+        classpath.append(entry)
+
+    return ResolvedLibraries(downloads, classpath, natives)
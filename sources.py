@@ -0,0 +1,39 @@
+import os
+from urllib.parse import urlsplit
+
+def is_remote(location):
+    return location.startswith('http://') or location.startswith('https://')
+
+def mirror_location(mirror, url):
+    """Where `url` lives in a mirror: <mirror>/<host>/<path>"""
+    parsed = urlsplit(url)
+    relative = parsed.netloc + parsed.path
+
+    if is_remote(mirror):
+        return mirror.rstrip('/') + '/' + relative
+
+    return os.path.join(mirror, *relative.split('/'))
+
+class SourceResolver(object):
+    """Rewrite upstream download URLs to local mirrors, in fallback order
+
+    A mirror is either an HTTP base URL or a directory, laid out as
+    <mirror>/<host>/<path> (see mirror.py). In offline mode only directory
+    mirrors are used and upstream is never contacted."""
+    def __init__(self, mirrors = None, offline = False):
+        super(SourceResolver, self).__init__()
+        self.mirrors = mirrors or []
+        self.offline = offline
+
+    def candidates(self, url):
+        locations = []
+        for mirror in self.mirrors:
+            if self.offline and is_remote(mirror):
+                continue
+
+            locations.append(mirror_location(mirror, url))
+
+        if not self.offline:
+            locations.append(url)
+
+        return locations
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+from common import ensure_dir, fetch
+from metrics import default_metrics
+from verify import sha1_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl number of FICLONE on Linux (btrfs, xfs) for copy-on-write clones
+FICLONE = 0x40049409
+
+def _clone(src, dst):
+    if fcntl:
+        try:
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return
+        except OSError:
+            pass
+
+    shutil.copyfile(src, dst)
+
+class ObjectStore(object):
+    """A content-addressed file store keyed by SHA-1, shared between client roots"""
+    def __init__(self, root):
+        super(ObjectStore, self).__init__()
+        self.root = root
+
+    def path(self, sha1):
+        return os.path.join(self.root, sha1[0:2], sha1)
+
+    def has(self, sha1):
+        return os.path.exists(self.path(sha1))
+
+    def check(self, sha1):
+        """Return True if the object is stored intact, removing it if it is damaged
+
+        Roots hardlink the stored objects, so a file corrupted in place in
+        any root corrupts the store as well."""
+        try:
+            if sha1_file(self.path(sha1)) == sha1:
+                return True
+        except OSError:
+            return False
+
+        # Another thread or root may have found the same damage first
+        try:
+            os.remove(self.path(sha1))
+            default_metrics().count('store.evictions')
+        except FileNotFoundError:
+            pass
+
+        return False
+
+    def link(self, sha1, target):
+        """Make `target` refer to the stored object.
+
+        Uses a hardlink where possible and falls back to a reflink or a copy
+        when the store and the target live on different filesystems."""
+        directory = os.path.dirname(target)
+        ensure_dir(directory)
+
+        # Link under a temporary name first so `target` appears atomically
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.store-')
+        os.close(fd)
+        os.remove(tmp)
+
+        try:
+            try:
+                os.link(self.path(sha1), tmp)
+            except OSError:
+                _clone(self.path(sha1), tmp)
+
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        return target
+
+    def fetch(self, url, sha1, target, session = None, progress = None, resolver = None):
+        """Download `url` into the store unless it is already there intact, then link it to `target`"""
+        if self.check(sha1):
+            default_metrics().count('store.hits')
+        else:
+            default_metrics().count('store.misses')
+            ensure_dir(os.path.dirname(self.path(sha1)))
+            fetch(url, self.path(sha1), sha1, session, progress, resolver=resolver)
+
+        return self.link(sha1, target)
@@ -0,0 +1,370 @@
+#!/usr/bin/python
+import os
+import json
+import time
+import shutil
+from optparse import OptionParser
+from client import natives_key
+from java import java_version, cds_archive
+from rules import resolve_libraries
+from verify import VerificationIndex, sha1_file
+
+categories = ['versions', 'partial', 'plans', 'natives', 'cds', 'args', 'libraries', 'asset_indexes', 'assets', 'store']
+
+def _size(path):
+    # Bytes actually freed by removing `path`: files with other hardlinks
+    # (into an object store or another root) free nothing
+    if not os.path.isdir(path) or os.path.islink(path):
+        st = os.lstat(path)
+        return st.st_size if st.st_nlink <= 1 else 0
+
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += _size(os.path.join(root, name))
+
+    return total
+
+def _mtime(path, depth = 2):
+    # A directory counts as touched when it or anything up to `depth`
+    # levels below it was, which covers natives/<key> in a version directory
+    st = os.lstat(path)
+    newest = st.st_mtime
+
+    if depth and os.path.isdir(path) and not os.path.islink(path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                newest = max(newest, _mtime(entry.path, depth - 1))
+
+    return newest
+
+def library_paths(metadata):
+    """Every library path a version refers to, for any platform"""
+    paths = set()
+
+    for lib in metadata.get('libraries', []):
+        dl = lib.get('downloads', {})
+
+        for artifact in [dl.get('artifact', {})] + list(dl.get('classifiers', {}).values()):
+            if 'path' in artifact:
+                paths.add(artifact['path'])
+
+    return paths
+
+class Collector(object):
+    """Find and remove files in a client root that no kept version needs
+
+    Starting from the kept versions (all installed ones by default) the
+    version JSONs lead to libraries, asset indexes and asset objects;
+    everything else is garbage. Nothing touched in the last `grace`
+    seconds is removed, which covers downloads in progress and games that
+    are running (launches touch the natives and argfile they use). With
+    a `store`, store objects go too when none of the kept versions of
+    `client_root` and the other `roots` sharing the store refers to them
+    and no other file is hardlinked to them."""
+    def __init__(self, client_root, keep = None, grace = 24 * 3600, store = None, roots = None):
+        super(Collector, self).__init__()
+        self.client_root = client_root
+        self.keep = keep
+        self.grace = grace
+        self.store = store
+        self.roots = roots or []
+        self.now = time.time()
+        self.warnings = []
+
+    def installed(self):
+        versions_dir = os.path.join(self.client_root, 'versions')
+        if not os.path.isdir(versions_dir):
+            return []
+
+        return sorted(name for name in os.listdir(versions_dir) if os.path.isdir(os.path.join(versions_dir, name)))
+
+    def metadata(self, version):
+        path = os.path.join(self.client_root, 'versions', version, '%s.json' % (version))
+
+        try:
+            with open(path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def old(self, path):
+        try:
+            return self.now - _mtime(path) >= self.grace
+        except OSError:
+            return False
+
+    def kept(self):
+        """The versions whose files stay: the kept ones and any used within the grace period"""
+        if self.keep is None:
+            return self.installed()
+
+        # A version that is not kept but was just used may still be running,
+        # so its libraries and assets count as reachable as well
+        versions_dir = os.path.join(self.client_root, 'versions')
+        return list(self.keep) + [version for version in self.installed()
+            if version not in self.keep and not self.old(os.path.join(versions_dir, version))]
+
+    def garbage(self):
+        """Yield (category, path) for everything that can be removed"""
+        kept = self.kept()
+        versions_dir = os.path.join(self.client_root, 'versions')
+
+        libraries = set()
+        indexes = set()
+        complete = True
+
+        for version in self.installed():
+            if version not in kept:
+                yield 'versions', os.path.join(versions_dir, version)
+
+        for version in kept:
+            metadata = self.metadata(version)
+            if metadata is None:
+                # Without the version JSON we can't tell what it needs
+                self.warnings.append('No metadata for %s, not collecting libraries and assets.' % (version))
+                complete = False
+                continue
+
+            libraries |= library_paths(metadata)
+            if 'assetIndex' in metadata:
+                indexes.add('%s.json' % (metadata['assetIndex']['id']))
+
+            for item in self.version_garbage(version, metadata):
+                yield item
+
+        if not complete:
+            return
+
+        for path in self.unreferenced(os.path.join(self.client_root, 'libraries'), libraries):
+            yield 'libraries', path
+
+        objects = set()
+        indexes_dir = os.path.join(self.client_root, 'assets', 'indexes')
+
+        for index in indexes:
+            try:
+                with open(os.path.join(indexes_dir, index)) as fp:
+                    objects |= set(data['hash'] for data in json.load(fp)['objects'].values())
+            except (OSError, ValueError, KeyError):
+                self.warnings.append('Asset index %s is missing, not collecting assets.' % (index))
+                return
+
+        for path in self.unreferenced(indexes_dir, indexes):
+            yield 'asset_indexes', path
+
+        objects_dir = os.path.join(self.client_root, 'assets', 'objects')
+        for path in self.unreferenced(objects_dir, set('%s/%s' % (h[0:2], h) for h in objects)):
+            yield 'assets', path
+
+    def version_garbage(self, version, metadata):
+        directory = os.path.join(self.client_root, 'versions', version)
+
+        # Natives extracted for the current metadata or named in a launch plan
+        natives = set([natives_key(resolve_libraries(metadata['libraries']).natives)])
+        archives = set()
+        java = java_version('java', os.path.join(self.client_root, 'java.json'))
+
+        try:
+            meta_sha1 = sha1_file(os.path.join(directory, '%s.json' % (version)))
+        except OSError:
+            meta_sha1 = None
+
+        plans_dir = os.path.join(directory, 'plans')
+        for name in os.listdir(plans_dir) if os.path.isdir(plans_dir) else []:
+            path = os.path.join(plans_dir, name)
+            if name.endswith('.tmp'):
+                yield 'partial', path
+                continue
+
+            try:
+                with open(path) as fp:
+                    plan = json.load(fp)
+            except (OSError, ValueError):
+                continue
+
+            # Built from metadata that has changed since, or for natives that
+            # are gone: load_plan would throw it away
+            if not plan.get('meta_sha1') == meta_sha1 or not os.path.isdir(plan['natives']):
+                yield 'plans', path
+                continue
+
+            natives.add(os.path.basename(plan['natives']))
+            archives.add(os.path.basename(cds_archive(os.path.join(directory, 'cds'), plan['classpath'], 'java', java)))
+
+        for name in os.listdir(directory):
+            # Natives directories of launchers before the natives cache
+            if name.startswith('natives-'):
+                yield 'natives', os.path.join(directory, name)
+
+            # Downloads of the version jar and JSON that never finished and
+            # writes that were cut short
+            if name.endswith('.part') or name.endswith('.tmp'):
+                yield 'partial', os.path.join(directory, name)
+
+        for category, sub, keep in (('natives', 'natives', natives), ('cds', 'cds', archives), ('args', 'args', set())):
+            path = os.path.join(directory, sub)
+            for name in os.listdir(path) if os.path.isdir(path) else []:
+                if name not in keep:
+                    yield category, os.path.join(path, name)
+
+    def unreferenced(self, directory, keep):
+        """Files below `directory` whose relative path (with / separators) is not in `keep`"""
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, directory).replace(os.sep, '/') not in keep:
+                    yield path
+
+    def hashes(self):
+        """SHA-1 of every file the kept versions refer to, or None if that can't be told"""
+        hashes = set()
+
+        for version in self.kept():
+            metadata = self.metadata(version)
+            if metadata is None:
+                return None
+
+            client_dl = metadata.get('downloads', {}).get('client', {})
+            hashes.add(client_dl.get('sha1'))
+
+            for lib in metadata.get('libraries', []):
+                dl = lib.get('downloads', {})
+
+                for artifact in [dl.get('artifact', {})] + list(dl.get('classifiers', {}).values()):
+                    hashes.add(artifact.get('sha1'))
+
+            if not 'assetIndex' in metadata:
+                continue
+
+            hashes.add(metadata['assetIndex'].get('sha1'))
+
+            try:
+                with open(os.path.join(self.client_root, 'assets', 'indexes', '%s.json' % (metadata['assetIndex']['id']))) as fp:
+                    hashes |= set(data['hash'] for data in json.load(fp)['objects'].values())
+            except (OSError, ValueError, KeyError):
+                return None
+
+        hashes.discard(None)
+        return hashes
+
+    def store_garbage(self):
+        # Reflinked or copied objects have a single link even while a root
+        # uses them, so what is in use is worked out from the roots' versions
+        used = set()
+
+        for root in [self.client_root] + list(self.roots):
+            collector = self if root == self.client_root else Collector(root, None, self.grace)
+            hashes = collector.hashes()
+
+            if hashes is None:
+                self.warnings.append('Can\'t tell which files %s uses, not collecting the store.' % (root))
+                return
+
+            used |= hashes
+
+        for root, dirs, files in os.walk(self.store.root):
+            for name in files:
+                path = os.path.join(root, name)
+                if name in used:
+                    continue
+
+                # Still hardlinked from a root we were not told about
+                try:
+                    if os.lstat(path).st_nlink <= 1:
+                        yield 'store', path
+                except OSError:
+                    pass
+
+    def collect(self, dry_run = False):
+        """Remove the garbage (unless `dry_run`) and report it per category
+
+        Returns {category: {'files': n, 'bytes': reclaimable bytes}}."""
+        report = dict((category, {'files': 0, 'bytes': 0}) for category in categories)
+
+        self.remove(list(self.garbage()), report, dry_run)
+
+        # After the root, so objects it just stopped using are collected too
+        if self.store:
+            self.remove(list(self.store_garbage()), report, dry_run)
+
+        if not dry_run:
+            for directory in ('libraries', os.path.join('assets', 'objects')):
+                self.remove_empty(os.path.join(self.client_root, directory))
+
+            if self.store:
+                self.remove_empty(self.store.root)
+
+            db = os.path.join(self.client_root, 'verify.db')
+            if os.path.exists(db):
+                index = VerificationIndex(db)
+                index.prune()
+                index.close()
+
+        return report
+
+    def remove(self, items, report, dry_run):
+        for category, path in items:
+            # Checked right before removing, in case it just got used again
+            if not self.old(path):
+                continue
+
+            try:
+                size = _size(path)
+
+                if not dry_run:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+            except OSError as e:
+                self.warnings.append('Failed to remove %s: %s' % (path, e))
+                continue
+
+            report[category]['files'] += 1
+            report[category]['bytes'] += size
+
+    def remove_empty(self, directory):
+        for root, dirs, files in os.walk(directory, topdown=False):
+            if not root == directory and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+if __name__ == '__main__':
+    from store import ObjectStore
+
+    parser = OptionParser(usage='usage: %prog [options] client_root')
+    parser.add_option('-k', '--keep', dest='keep', action='append',
+        help='Keep this version, remove all others (repeatable; default: keep every installed version)')
+    parser.add_option('-g', '--grace', dest='grace', type='int', default=24 * 3600,
+        help='Never remove anything used in the last GRACE seconds (default: 86400)')
+    parser.add_option('-s', '--store', dest='store',
+        help='Also remove objects of this object store that no kept version uses')
+    parser.add_option('-r', '--root', dest='roots', action='append',
+        help='Another client root using the store, whose installed versions are kept (repeatable)')
+    parser.add_option('-n', '--dry-run', dest='dry_run', action='store_true', default=False,
+        help='Only report what would be removed')
+    parser.add_option('--json', dest='json', action='store_true', default=False,
+        help='Print the report as JSON')
+
+    (options, args) = parser.parse_args()
+    if not len(args) == 1:
+        parser.error('A client root directory is required')
+
+    collector = Collector(args[0], options.keep, options.grace, ObjectStore(options.store) if options.store else None,
+        options.roots)
+    report = collector.collect(options.dry_run)
+
+    for warning in collector.warnings:
+        print(warning)
+
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for category in categories:
+            print('%-14s %6d files %10.2f MB' % (category, report[category]['files'], report[category]['bytes'] / 1024 / 1024))
+
+        total = sum(r['bytes'] for r in report.values())
+        print('%s %.2f MB' % ('Reclaimable:' if options.dry_run else 'Reclaimed:', total / 1024 / 1024))
@@ -0,0 +1,232 @@
+import os
+import re
+import time
+import threading
+from logcapture import LogCapture, PrintSink
+
+# Default -Xmx when a client's jvm string has none, and the memory a JVM
+# uses on top of its heap (metaspace, code cache, native buffers)
+DEFAULT_HEAP = 1024 ** 3
+JVM_OVERHEAD = 256 * 1024 ** 2
+
+def parse_memory(value):
+    """Convert a JVM memory size like 512M or 2G to bytes"""
+    match = re.match(r'^(\d+)([kKmMgGtT]?)$', value)
+    if not match:
+        raise ValueError('Invalid memory size %s!' % (value))
+
+    units = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    return int(match.group(1)) * units[match.group(2).lower()]
+
+def heap_size(client):
+    match = re.search(r'-Xmx(\S+)', client.jvm or '')
+    return parse_memory(match.group(1)) if match else DEFAULT_HEAP
+
+def available_memory():
+    """Bytes of memory available for new processes, or None if unknown"""
+    try:
+        with open('/proc/meminfo') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+class Instance(object):
+    """A client managed by a Supervisor"""
+    def __init__(self, name, client, restart = False, max_restarts = 3):
+        super(Instance, self).__init__()
+        self.name = name
+        self.client = client
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.memory = heap_size(client) + JVM_OVERHEAD
+
+        # pending, preparing, running, exited, crashed, failed or stopped
+        self.status = 'pending'
+        self.restarts = 0
+        self.returncode = None
+        self.error = None
+        self.process = None
+        self.started = None
+        self.thread = None
+        self.log = None
+
+    def info(self):
+        return {
+            'status': self.status,
+            'pid': self.process.pid if self.process and self.status == 'running' else None,
+            'returncode': self.returncode,
+            'restarts': self.restarts,
+            'uptime': time.time() - self.started if self.started and self.status == 'running' else None,
+            'memory': self.memory,
+            'error': self.error,
+            'errors': self.log.counts['ERROR'] + self.log.counts['FATAL'] if self.log else 0
+        }
+
+    def tail(self, lines = 20, level = None):
+        return self.log.tail(lines, level) if self.log else []
+
+class Supervisor(object):
+    """Start and watch many clients on one host
+
+    Instances are started in the order they were added, as long as the
+    memory they are expected to use (their -Xmx plus JVM overhead) fits in
+    `max_memory`, which defaults to what is available when `start` is called
+    minus `reserve`. Cold starts, which still have to install, are spaced
+    `stagger` seconds apart so they don't all hit the disk at once. Game
+    output goes to `sinks` (see logcapture), by default printed with the
+    instance name as prefix."""
+    def __init__(self, max_memory = None, reserve = 512 * 1024 ** 2, stagger = 5.0, max_running = None,
+            poll = 0.5, sinks = None):
+        super(Supervisor, self).__init__()
+        self.max_memory = max_memory
+        self.reserve = reserve
+        self.stagger = stagger
+        self.max_running = max_running
+        self.poll = poll
+        self.sinks = sinks
+        self.instances = []
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.last_cold_start = 0
+        self.thread = None
+
+    def add(self, client, name = None, restart = False, max_restarts = 3):
+        instance = Instance(name or 'instance-%d' % (len(self.instances) + 1), client, restart, max_restarts)
+
+        with self.lock:
+            self.instances.append(instance)
+
+        return instance
+
+    def start(self):
+        if self.max_memory is None:
+            available = available_memory()
+            if available is not None:
+                self.max_memory = max(0, available - self.reserve)
+
+        self.stopping = False
+        self.thread = threading.Thread(target=self.schedule, name='supervisor', daemon=True)
+        self.thread.start()
+
+    def active(self):
+        return [i for i in self.instances if i.status in ('preparing', 'running')]
+
+    def fits(self, instance):
+        active = self.active()
+
+        if self.max_running and len(active) >= self.max_running:
+            return False
+
+        # Never hold back an instance when nothing else is running
+        if not active or self.max_memory is None:
+            return True
+
+        return sum(i.memory for i in active) + instance.memory <= self.max_memory
+
+    def schedule(self):
+        while not self.stopping:
+            with self.lock:
+                for instance in self.instances:
+                    if not instance.status == 'pending' or not self.fits(instance):
+                        continue
+
+                    cold = instance.client.load_plan() is None
+                    if cold and time.monotonic() - self.last_cold_start < self.stagger:
+                        continue
+
+                    if cold:
+                        self.last_cold_start = time.monotonic()
+
+                    instance.status = 'preparing'
+                    instance.thread = threading.Thread(target=self.run, args=(instance,),
+                        name='instance-%s' % (instance.name), daemon=True)
+                    instance.thread.start()
+
+            if all(i.status in ('exited', 'crashed', 'failed', 'stopped') for i in self.instances):
+                break
+
+            time.sleep(self.poll)
+
+    def run(self, instance):
+        client = instance.client
+
+        # Like init_mc, every launch ends up in the metrics exporters
+        with client.launch_summary() as summary:
+            try:
+                client.prepare()
+
+                # stop() may have been called while we were installing; holding
+                # the lock across spawn means it either sees the process or we
+                # see that it was called
+                with self.lock:
+                    if self.stopping:
+                        instance.status = 'stopped'
+                        return
+
+                    instance.process = client.spawn()
+                    instance.started = time.time()
+                    instance.status = 'running'
+
+                summary.started()
+            except Exception as e:
+                instance.error = summary.error = str(e)
+                instance.status = 'failed'
+                return
+
+            # Every instance prints with its name as prefix unless sinks were given
+            sinks = self.sinks if self.sinks is not None else [PrintSink('%s >>> ' % (instance.name))]
+            instance.log = LogCapture(instance.process, sinks)
+            instance.log.wait()
+
+            instance.returncode = instance.process.wait()
+            summary.returncode = instance.returncode
+            client.cleanup()
+
+        with self.lock:
+            if self.stopping:
+                instance.status = 'stopped'
+            elif instance.returncode == 0:
+                instance.status = 'exited'
+            elif instance.restart and instance.restarts < instance.max_restarts:
+                instance.restarts += 1
+                instance.status = 'pending'
+            else:
+                instance.status = 'crashed'
+
+    def status(self):
+        with self.lock:
+            return dict((i.name, i.info()) for i in self.instances)
+
+    def stop(self, timeout = 30):
+        """Terminate every running game and stop scheduling new ones"""
+        with self.lock:
+            self.stopping = True
+
+            for instance in self.instances:
+                if instance.status == 'pending':
+                    instance.status = 'stopped'
+                elif instance.process and instance.process.poll() is None:
+                    instance.process.terminate()
+
+        for instance in list(self.instances):
+            if instance.process:
+                try:
+                    instance.process.wait(timeout)
+                except Exception:
+                    instance.process.kill()
+
+    def wait(self):
+        """Block until every instance has finished for good"""
+        if self.thread:
+            self.thread.join()
+
+        for instance in list(self.instances):
+            if instance.thread:
+                instance.thread.join()
@@ -0,0 +1,48 @@
+import os
+import json
+import threading
+from common import replace_file
+
+class TokenStore(object):
+    """File-backed cache of Mojang access tokens, keyed by username and client token
+
+    The file is created readable and writable by its owner only."""
+    def __init__(self, path):
+        super(TokenStore, self).__init__()
+        self.path = path
+        self.lock = threading.Lock()
+
+    def key(self, username, client_token):
+        return '%s:%s' % (username, client_token)
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, tokens):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+
+        with replace_file(self.path, perms=0o600) as fp:
+            json.dump(tokens, fp)
+
+    def get(self, username, client_token):
+        with self.lock:
+            return self.load().get(self.key(username, client_token))
+
+    def put(self, username, client_token, entry):
+        # Re-read before writing so entries saved by other processes survive
+        with self.lock:
+            tokens = self.load()
+            tokens[self.key(username, client_token)] = entry
+            self.save(tokens)
+
+    def remove(self, username, client_token):
+        with self.lock:
+            tokens = self.load()
+            if tokens.pop(self.key(username, client_token), None) is not None:
+                self.save(tokens)
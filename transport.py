@@ -0,0 +1,35 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_default = None
+_default_lock = threading.Lock()
+
+class Session(requests.Session):
+    """A pooled HTTP session with keep-alive, retries and default timeouts"""
+    def __init__(self, pool_size = 16, retries = 3, backoff = 0.5, timeout = (10, 60)):
+        super(Session, self).__init__()
+        self.timeout = timeout
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504))
+
+        # pool_maxsize caps the number of kept-alive connections per host
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(Session, self).request(method, url, **kwargs)
+
+def default_session():
+    """Return the launcher-wide shared session, creating it on first use"""
+    global _default
+
+    with _default_lock:
+        if _default is None:
+            _default = Session()
+
+    return _default
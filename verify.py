@@ -0,0 +1,157 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import default_metrics
+
+# Read size when hashing; hashlib releases the GIL for large updates so
+# threads hash on several cores at once
+HASH_BUFFER = 1024 * 1024
+
+def sha1_file(path):
+    hash_sha1 = hashlib.sha1()
+
+    with default_metrics().timer('hash'), open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(HASH_BUFFER), b''):
+            hash_sha1.update(block)
+
+    return hash_sha1.hexdigest()
+
+def list_objects(directory, prefixes):
+    """Size and mtime of every file in the given subdirectories of `directory`
+
+    Each subdirectory is listed once, returning {name: (size, mtime_ns)}
+    instead of checking files one by one."""
+    found = {}
+
+    for prefix in prefixes:
+        try:
+            with os.scandir(os.path.join(directory, prefix)) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        found[entry.name] = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+
+    return found
+
+class VerificationIndex(object):
+    """Persistent record of verified files (size, mtime and SHA-1), kept in sqlite
+
+    Paths are stored relative to the directory holding the database, so a
+    client root can be moved without invalidating its index."""
+    def __init__(self, path):
+        super(VerificationIndex, self).__init__()
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+            'mtime INTEGER, sha1 TEXT)')
+        self.db.commit()
+
+    def key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def record(self, path, sha1):
+        self.record_many([(path, sha1)])
+
+    def record_many(self, files):
+        rows = []
+        for path, sha1 in files:
+            st = os.stat(path)
+            rows.append((self.key(path), st.st_size, st.st_mtime_ns, sha1))
+
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', rows)
+            self.db.commit()
+
+    def forget(self, path):
+        with self.lock:
+            self.db.execute('DELETE FROM files WHERE path = ?', (self.key(path),))
+            self.db.commit()
+
+    def prune(self):
+        """Drop the records of files that no longer exist, returning how many"""
+        with self.lock:
+            rows = self.db.execute('SELECT path FROM files').fetchall()
+
+        gone = [row for row in rows if not os.path.exists(os.path.join(self.root, row[0]))]
+
+        with self.lock:
+            self.db.executemany('DELETE FROM files WHERE path = ?', gone)
+            self.db.commit()
+
+        return len(gone)
+
+    def lookup(self, path):
+        with self.lock:
+            return self.db.execute('SELECT size, mtime, sha1 FROM files WHERE path = ?',
+                (self.key(path),)).fetchone()
+
+    def entries(self, directory):
+        """Every recorded file below `directory`, as {key: (size, mtime, sha1)}"""
+        prefix = os.path.join(self.key(directory), '')
+
+        # A range over the primary key instead of LIKE, so sqlite uses its index
+        with self.lock:
+            rows = self.db.execute('SELECT path, size, mtime, sha1 FROM files WHERE path >= ? AND path < ?',
+                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))).fetchall()
+
+        return dict((row[0], row[1:]) for row in rows)
+
+    def check(self, path, sha1):
+        """Return True if `path` exists and has the given SHA-1.
+
+        The file is only hashed again if its size or mtime changed since it
+        was last verified."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            default_metrics().count('verify.misses')
+            return False
+
+        if self.lookup(path) == (st.st_size, st.st_mtime_ns, sha1):
+            default_metrics().count('verify.hits')
+            return True
+
+        default_metrics().count('verify.rehashes')
+
+        if sha1_file(path) != sha1:
+            self.forget(path)
+            return False
+
+        self.record(path, sha1)
+        return True
+
+    def verify_all(self, workers = None):
+        """Hash every recorded file in parallel, returning the paths that no longer match"""
+        with self.lock:
+            rows = self.db.execute('SELECT path, sha1 FROM files').fetchall()
+
+        def bad(row):
+            path = os.path.join(self.root, row[0])
+            try:
+                if sha1_file(path) == row[1]:
+                    self.record(path, row[1])
+                    return None
+            except OSError:
+                pass
+
+            return path
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            failed = [path for path in pool.map(bad, rows) if path]
+
+        for path in failed:
+            self.forget(path)
+
+        return failed
+
+    def close(self):
+        self.db.close()